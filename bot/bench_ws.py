@@ -0,0 +1,74 @@
+# WebSocket framing benchmark
+# Compares bytes on the wire and CPU per event for the /ws encodings:
+#   python bench_ws.py [--events 2000] [--sockets 1000]
+
+import argparse
+import time
+import zlib
+
+from bot import Frame, encode_payload
+
+def sample_events():
+    """Representative events for the high-rate streams"""
+    log = {
+        'server_name': 'Psi Community',
+        'channel_name': 'general',
+        'username': 'someone#1234',
+        'user_id': '777206368389038081',
+        'content': 'hey, did anyone see the new meme in the feed? it is pretty good honestly',
+        'created_at': '2026-10-19 12:00:00'
+    }
+    votes = {'votes': [
+        {'memeId': 1000 + i, 'likeCount': 120 + i * 3, 'dislikeCount': 4 + i}
+        for i in range(20)
+    ]}
+    vote = {'memeId': 1042, 'likeCount': 311, 'dislikeCount': 12}
+    return [('new_log', log, ['logs']), ('vote_batch', votes, ['votes']), ('vote_update', vote, ['meme:1042'])]
+
+def deflate(payload):
+    """permessage-deflate without context takeover (worst case per message)"""
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(payload) + compressor.flush(zlib.Z_SYNC_FLUSH)[:-4]
+
+def cpu_per_call(fn, n):
+    start = time.process_time()
+    for _ in range(n):
+        fn()
+    return (time.process_time() - start) / n
+
+def bench(event, data, topics, encoding, compress, n):
+    """Returns (bytes on the wire, encode seconds per event, deflate seconds per socket)"""
+    # A fresh Frame each time so the per-encoding cache doesn't hide the cost
+    encode = cpu_per_call(lambda: Frame(0, event, data, topics, ()).encoded(encoding), n)
+    payload = Frame(0, event, data, topics, ()).encoded(encoding)
+    if not compress:
+        size = len(payload.encode('utf-8')) if isinstance(payload, str) else len(payload)
+        return size, encode, 0.0
+    # aiohttp compresses separately for every socket that negotiated deflate
+    return len(deflate(payload)), encode, cpu_per_call(lambda: deflate(payload), n)
+
+def main():
+    parser = argparse.ArgumentParser(description="WebSocket framing benchmark")
+    parser.add_argument('--events', type=int, default=2000, help='iterations per measurement')
+    parser.add_argument('--sockets', type=int, default=1000, help='fan-out size for the per-event totals')
+    args = parser.parse_args()
+
+    print(f"fan-out totals are CPU ms per event for {args.sockets} sockets\n")
+    print(f"{'event':<12} {'framing':<17} {'bytes':>6} {'encode us':>10} {'deflate us':>11} "
+          f"{'fan-out ms':>11} {'per-socket json ms':>19}")
+
+    for event, data, topics in sample_events():
+        # What broadcast() cost before frames were shared: json.dumps for every socket
+        legacy = cpu_per_call(lambda: encode_payload({'event': event, 'data': data}, 'json'), args.events)
+        for encoding in ('json', 'msgpack'):
+            for compress in (False, True):
+                size, encode, deflate_cpu = bench(event, data, topics, encoding, compress, args.events)
+                fanout = encode + deflate_cpu * args.sockets
+                framing = encoding + ('+deflate' if compress else '')
+                print(f"{event:<12} {framing:<17} {size:>6} {encode * 1e6:>10.1f} {deflate_cpu * 1e6:>11.1f} "
+                      f"{fanout * 1e3:>11.2f} {legacy * args.sockets * 1e3:>19.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -5,14 +5,37 @@ import discord
 from discord.ext import commands
 import asyncio
 import aiosqlite
-from datetime import datetime, timezone
+from datetime import datetime, timezone, timedelta
 import os
 from dotenv import load_dotenv
 from aiohttp import web
 import aiohttp
 import json
 import random
+import re
 import hashlib
+import heapq
+import math
+import msgpack
+import multiprocessing
+import socket
+import struct
+import tempfile
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+try:
+    import resource
+except ImportError:
+    resource = None  # not available on Windows
 
 load_dotenv()
 
@@ -27,6 +50,77 @@ CHANNEL_ID_LOGS = int(_logs_channel) if _logs_channel else 0
 _big_action = os.getenv("BIG_ACTION_ID", "0")
 BIG_ACTION_ID = int(_big_action) if _big_action else 0
 
+# Web tier (WEB_WORKERS > 1 runs extra web processes sharing the port via SO_REUSEPORT)
+WEB_HOST = os.getenv("WEB_HOST", "0.0.0.0")
+WEB_PORT = int(os.getenv("WEB_PORT", "5000"))
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "1"))
+EVENT_BUS_PATH = os.getenv("EVENT_BUS_PATH") or os.path.join(tempfile.gettempdir(), f"diskord-bus-{WEB_PORT}.sock")
+WORKER_ID = 0  # 0 = primary process
+# 'combined' runs the bot on the primary web process's loop, 'split' gives it its own process
+RUN_MODE = os.getenv("RUN_MODE", "combined")
+GUILD_SNAPSHOT_INTERVAL = int(os.getenv("GUILD_SNAPSHOT_INTERVAL", "10"))
+
+# Sharding: SHARD_COUNT unset = one gateway connection, 'auto' = Discord's recommended count.
+# SHARD_IDS limits this process to some shards; BOT_PROCESSES > 1 spreads them over split-mode bot processes.
+_shard_count = os.getenv("SHARD_COUNT", "")
+SHARDED = bool(_shard_count)
+SHARD_COUNT = int(_shard_count) if _shard_count.isdigit() else None
+SHARD_IDS = [int(i) for i in os.getenv("SHARD_IDS", "").split(",") if i.strip()] or None
+BOT_PROCESSES = int(os.getenv("BOT_PROCESSES", "1"))
+
+# Member cache: 'all', 'none', or flags like 'voice,joined' (see discord.MemberCacheFlags)
+MEMBER_CACHE = os.getenv("MEMBER_CACHE", "all")
+# 'startup' chunks every guild on connect, 'lazy' chunks a guild the first time a command needs
+# its members, 'off' never chunks (members are fetched one at a time)
+MEMBER_CHUNKING = os.getenv("MEMBER_CHUNKING", "startup")
+MESSAGE_CACHE_SIZE = int(os.getenv("MESSAGE_CACHE_SIZE", "1000"))  # 0 disables the message cache
+# Logged messages kept in memory so Save clicks don't need the database or the API
+RECENT_MESSAGE_CACHE = int(os.getenv("RECENT_MESSAGE_CACHE", "500"))
+# Save clicks waiting for a folder name: seconds to wait, how many to hold, keep across restarts
+PENDING_SAVE_TTL = int(os.getenv("PENDING_SAVE_TTL", "300"))
+PENDING_SAVE_MAX = int(os.getenv("PENDING_SAVE_MAX", "10000"))
+PENDING_SAVE_PERSIST = os.getenv("PENDING_SAVE_PERSIST", "0") == "1"
+
+# Flood and raid detection (active with autoModeration; 0 disables a limit)
+SPAM_WINDOW = int(os.getenv("SPAM_WINDOW", "10"))  # seconds
+SPAM_USER_MESSAGES = int(os.getenv("SPAM_USER_MESSAGES", "8"))  # per user per window -> timeout
+SPAM_TIMEOUT = os.getenv("SPAM_TIMEOUT", "10m")
+SPAM_CHANNEL_MESSAGES = int(os.getenv("SPAM_CHANNEL_MESSAGES", "40"))  # per channel per window -> slowmode
+SPAM_SLOWMODE = int(os.getenv("SPAM_SLOWMODE", "10"))  # slowmode seconds
+SPAM_GUILD_MESSAGES = int(os.getenv("SPAM_GUILD_MESSAGES", "300"))  # per guild per window -> slowmode in its active channels
+RAID_WINDOW = int(os.getenv("RAID_WINDOW", "30"))  # seconds
+RAID_JOINS = int(os.getenv("RAID_JOINS", "10"))  # per guild per window -> lockdown
+RAID_LOCKDOWN = int(os.getenv("RAID_LOCKDOWN", "600"))  # seconds before slowmode/lockdown is lifted
+
+# Welcome messages: joins within the window share one message mentioning at most WELCOME_MAX_MENTIONS
+WELCOME_WINDOW = float(os.getenv("WELCOME_WINDOW", "5"))
+WELCOME_MAX_MENTIONS = int(os.getenv("WELCOME_MAX_MENTIONS", "20"))
+
+# Bulk moderation: parallel workers per job, requests per second over all jobs, targets per job
+BULK_CONCURRENCY = int(os.getenv("BULK_CONCURRENCY", "4"))
+BULK_RATE = float(os.getenv("BULK_RATE", "5"))
+BULK_MAX_TARGETS = int(os.getenv("BULK_MAX_TARGETS", "5000"))
+
+# Broadcast: sends in flight, sends per second (Discord allows 50 requests/s per bot),
+# attempts per channel
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "10"))
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "40"))
+BROADCAST_RETRIES = int(os.getenv("BROADCAST_RETRIES", "3"))
+
+# Outbound sends: workers, requests per second over all channels, and the per-channel
+# message limit (OUTBOUND_CHANNEL_BURST per OUTBOUND_CHANNEL_WINDOW seconds)
+OUTBOUND_WORKERS = int(os.getenv("OUTBOUND_WORKERS", "8"))
+OUTBOUND_RATE = float(os.getenv("OUTBOUND_RATE", "45"))
+OUTBOUND_CHANNEL_BURST = int(os.getenv("OUTBOUND_CHANNEL_BURST", "5"))
+OUTBOUND_CHANNEL_WINDOW = float(os.getenv("OUTBOUND_CHANNEL_WINDOW", "5"))
+OUTBOUND_MAX_BULK = int(os.getenv("OUTBOUND_MAX_BULK", "200"))  # bulk sends queued per channel before new ones are dropped
+
+# Purge: messages per clear, messages scanned per clear, deletes per second for messages
+# older than 14 days (those can't be bulk deleted)
+PURGE_MAX = int(os.getenv("PURGE_MAX", "5000"))
+PURGE_SCAN_MAX = int(os.getenv("PURGE_SCAN_MAX", "20000"))
+PURGE_OLD_RATE = float(os.getenv("PURGE_OLD_RATE", "1"))
+
 # Colors
 PSI_YELLOW = 0xffe989
 DARK_RED = 0xad1f1f
@@ -34,29 +128,90 @@ DARK_RED = 0xad1f1f
 # Owner ID (cannot be removed from admins)
 _owner_id = os.getenv("OWNER_ID", "777206368389038081")
 OWNER_ID = int(_owner_id) if _owner_id else 777206368389038081
+# Admin-only API routes require an X-User-Id header naming a bot admin. Only enable this
+# behind a proxy that sets the header from the logged-in session.
+REQUIRE_API_ADMIN = os.getenv("REQUIRE_API_ADMIN", "0") == "1"
+
+# Meme repost detection (perceptual hash)
+PHASH_WORKERS = int(os.getenv("PHASH_WORKERS", "2"))
+MEME_REPOST_DISTANCE = int(os.getenv("MEME_REPOST_DISTANCE", "6"))
+MEME_REPOST_MODE = os.getenv("MEME_REPOST_MODE", "flag")  # 'flag' or 'reject'
+
+# Random meme command: 'uniform' or 'likes' (1 + likes as the weight), and how many recent
+# memes per channel are not repeated
+MEME_WEIGHTING = os.getenv("MEME_WEIGHTING", "uniform")
+MEME_NO_REPEAT = int(os.getenv("MEME_NO_REPEAT", "20"))
+
+# WebSocket fan-out (frames queued per client before it is disconnected)
+WS_QUEUE_SIZE = int(os.getenv("WS_QUEUE_SIZE", "256"))
+WS_MAX_TOPICS = int(os.getenv("WS_MAX_TOPICS", "100"))
+# Vote updates are batched per meme over this window (0 = send each vote)
+VOTE_COALESCE_MS = int(os.getenv("VOTE_COALESCE_MS", "150"))
+# Recent events kept for clients resuming after a reconnect
+WS_REPLAY_SIZE = int(os.getenv("WS_REPLAY_SIZE", "1000"))
+# Liveness and admission (0 disables a limit)
+WS_HEARTBEAT = float(os.getenv("WS_HEARTBEAT", "30"))
+WS_IDLE_TIMEOUT = int(os.getenv("WS_IDLE_TIMEOUT", "300"))
+WS_MAX_CONNECTIONS = int(os.getenv("WS_MAX_CONNECTIONS", "5000"))
+WS_MAX_PER_IP = int(os.getenv("WS_MAX_PER_IP", "20"))
+# Header a reverse proxy puts the client address in (e.g. X-Forwarded-For); unset = socket peer
+WS_CLIENT_IP_HEADER = os.getenv("WS_CLIENT_IP_HEADER", "")
 
 # Bot setup
 intents = discord.Intents.default()
 intents.message_content = True
 intents.messages = True
 intents.members = True
-bot = commands.Bot(command_prefix="C7/", intents=intents)
+
+def member_cache_flags():
+    if MEMBER_CACHE == 'all':
+        return discord.MemberCacheFlags.from_intents(intents)
+    flags = discord.MemberCacheFlags.none()
+    for name in MEMBER_CACHE.split(','):
+        name = name.strip()
+        if not name or name == 'none':
+            continue
+        if name not in discord.MemberCacheFlags.VALID_FLAGS:
+            print(f"[CONFIG] X Ignoring unknown MEMBER_CACHE flag '{name}' (valid: {', '.join(sorted(discord.MemberCacheFlags.VALID_FLAGS))})")
+            continue
+        setattr(flags, name, True)
+    return flags
+
+def get_prefix(bot, message):
+    """Per-guild prefix from the settings cache"""
+    return guild_setting(message.guild.id if message.guild else 0, 'prefix')
+
+bot_options = {
+    'command_prefix': get_prefix,
+    'intents': intents,
+    'member_cache_flags': member_cache_flags(),
+    'chunk_guilds_at_startup': MEMBER_CHUNKING == 'startup',
+    'max_messages': MESSAGE_CACHE_SIZE or None
+}
+if SHARDED:
+    bot = commands.AutoShardedBot(shard_count=SHARD_COUNT, shard_ids=SHARD_IDS, **bot_options)
+else:
+    bot = commands.Bot(**bot_options)
 
 # Globals
 db_conn = None
-waiting_users = {}
 logs_channel = None
 big_action_channel = None
-connected_websockets = set()
+status_task = None
+connected_websockets = {}  # ws -> WSClient
+topic_subscribers = {}  # topic -> set of WSClient
+folder_servers = {}  # folder id -> set of server ids
+server_folder_ids = {}  # server id -> set of folder ids
+admin_ids = set()  # user ids in bot_admins
+guild_settings = {}  # guild id -> {key: value}; guild 0 holds the defaults
+memory_reporters = {}  # cache name -> function() returning its sizes
 
 # --- DATABASE ---
 DB_PATH = os.path.join(os.path.dirname(__file__), 'database.db')
 
 async def init_database():
     """Initialize SQLite database with all required tables"""
-    global db_conn
-    db_conn = await aiosqlite.connect(DB_PATH)
-    db_conn.row_factory = aiosqlite.Row
+    await init_database_connection()
     
     await db_conn.executescript("""
         -- Members table
@@ -79,6 +234,7 @@ async def init_database():
             user_id INTEGER,
             username TEXT,
             content TEXT,
+            message_id INTEGER,
             created_at TEXT DEFAULT CURRENT_TIMESTAMP
         );
         
@@ -129,6 +285,7 @@ async def init_database():
             user_id INTEGER NOT NULL,
             like_count INTEGER DEFAULT 0,
             dislike_count INTEGER DEFAULT 0,
+            phash INTEGER,
             created_at TEXT DEFAULT CURRENT_TIMESTAMP
         );
         
@@ -164,10 +321,1063 @@ async def init_database():
             key TEXT PRIMARY KEY,
             value TEXT
         );
+        
+        -- Per-guild settings (guild_id 0 = defaults for every guild)
+        CREATE TABLE IF NOT EXISTS guild_settings (
+            guild_id INTEGER,
+            key TEXT,
+            value TEXT,
+            PRIMARY KEY (guild_id, key)
+        );
+        
+        -- Auto-moderation rules (guild_id 0 = every guild)
+        CREATE TABLE IF NOT EXISTS automod_rules (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            guild_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            pattern TEXT,
+            action TEXT DEFAULT 'delete',
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        );
+        
+        -- Moderation actions (same layout as the dashboard server's action log)
+        CREATE TABLE IF NOT EXISTS action_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            action_type TEXT NOT NULL,
+            actor_id TEXT NOT NULL,
+            actor_name TEXT NOT NULL,
+            target_type TEXT,
+            target_id TEXT,
+            target_name TEXT,
+            details TEXT,
+            server_id TEXT,
+            server_name TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        );
+        
+        -- Bulk ban/kick/mute runs, resumed after a restart
+        CREATE TABLE IF NOT EXISTS bulk_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            guild_id INTEGER NOT NULL,
+            channel_id INTEGER,
+            progress_message_id INTEGER,
+            action TEXT NOT NULL,
+            reason TEXT,
+            duration TEXT,
+            actor_id INTEGER,
+            actor_name TEXT,
+            status TEXT DEFAULT 'running',
+            total INTEGER DEFAULT 0,
+            done INTEGER DEFAULT 0,
+            failed INTEGER DEFAULT 0,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        );
+        
+        CREATE TABLE IF NOT EXISTS bulk_job_targets (
+            job_id INTEGER REFERENCES bulk_jobs(id) ON DELETE CASCADE,
+            user_id INTEGER,
+            status TEXT DEFAULT 'pending',
+            error TEXT,
+            PRIMARY KEY (job_id, user_id)
+        );
+        
+        -- Slowmode and raised verification levels to undo when RAID_LOCKDOWN ends
+        CREATE TABLE IF NOT EXISTS flood_lockdowns (
+            kind TEXT NOT NULL,
+            target_id INTEGER NOT NULL,
+            guild_id INTEGER NOT NULL,
+            previous INTEGER,
+            expires_at REAL,
+            PRIMARY KEY (kind, target_id)
+        );
+        
+        -- Save clicks waiting for a folder name (PENDING_SAVE_PERSIST=1)
+        CREATE TABLE IF NOT EXISTS pending_saves (
+            key INTEGER PRIMARY KEY,
+            data TEXT,
+            expires_at REAL
+        );
     """)
+    
+    # Columns added after the first release
+    await ensure_column('memes', 'phash', 'INTEGER')
+    await db_conn.execute("CREATE INDEX IF NOT EXISTS idx_memes_phash ON memes(phash)")
+    await ensure_column('message_logs', 'message_id', 'INTEGER')
+    # saved_msg.user_id is the message author; saves made before saved_by existed keep it NULL
+    # (the saver is unknown) and stay listed, shared as they always were, as legacy saves
+    await ensure_column('saved_msg', 'saved_by', 'INTEGER')
+    await db_conn.execute("CREATE INDEX IF NOT EXISTS idx_saved_msg_owner ON saved_msg(saved_by, folder, timestamp, id)")
+    # Global bot_settings became the defaults row of guild_settings
+    await db_conn.execute("INSERT OR IGNORE INTO guild_settings (guild_id, key, value) SELECT 0, key, value FROM bot_settings")
+    await db_conn.execute("CREATE INDEX IF NOT EXISTS idx_automod_rules_guild ON automod_rules(guild_id)")
+    await db_conn.execute("CREATE INDEX IF NOT EXISTS idx_action_logs_server ON action_logs(server_id, id)")
+    
     await db_conn.commit()
     print("[DB] + Database initialized")
 
+async def init_database_connection():
+    """Open the shared SQLite database for concurrent use by several processes"""
+    global db_conn
+    db_conn = await aiosqlite.connect(DB_PATH)
+    db_conn.row_factory = aiosqlite.Row
+    await db_conn.execute("PRAGMA journal_mode=WAL")
+    await db_conn.execute("PRAGMA busy_timeout=5000")
+
+async def ensure_column(table, column, decl):
+    """Add a column to an existing table if an older database lacks it; True if it was added"""
+    cursor = await db_conn.execute(f"PRAGMA table_info({table})")
+    columns = {r['name'] for r in await cursor.fetchall()}
+    if column not in columns:
+        await db_conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+        return True
+    return False
+
+# --- EVENT BUS ---
+# Carries broadcast() events and cache changes between processes. Every message is
+# also delivered to the publishing process, so local and remote state change the same way.
+BUS_MAX_MESSAGE = 16 * 1024 * 1024
+
+class LocalEventBus:
+    """In-process bus for single process deployments (and as a fake in tests)"""
+    def __init__(self):
+        self.handlers = {}  # channel -> list of callbacks
+    
+    def subscribe(self, channel, handler):
+        self.handlers.setdefault(channel, []).append(handler)
+    
+    async def start(self):
+        pass
+    
+    async def publish(self, channel, message):
+        await self.dispatch(channel, message)
+    
+    async def dispatch(self, channel, message):
+        for handler in self.handlers.get(channel, ()):
+            try:
+                result = handler(message)
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception as e:
+                print(f"[BUS] X Handler for '{channel}' failed: {e}")
+
+BUS_PEER_QUEUE = 10000  # lines waiting for one process before the hub drops it
+WS_LINE_PREFIX = b'{"ch": "ws", '  # how UnixSocketBus.publish serializes 'ws' envelopes
+
+class UnixSocketHub:
+    """Relays newline-delimited JSON messages between processes over a unix socket.
+    WebSocket events are numbered here, so every web worker shares one stream and sequence"""
+    def __init__(self, path):
+        self.path = path
+        self.peers = {}  # writer -> queue of lines for it
+        self.server = None
+        self.stream_id = uuid.uuid4().hex[:12]
+        self.ws_seq = 0
+    
+    async def start(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.server = await asyncio.start_unix_server(self._serve_peer, path=self.path, limit=BUS_MAX_MESSAGE)
+        print(f"[BUS] + Hub listening on {self.path}")
+    
+    async def _serve_peer(self, reader, writer):
+        queue = self.peers[writer] = asyncio.Queue()
+        writer_task = asyncio.create_task(self._write_peer(writer, queue))
+        queue.put_nowait(self._envelope('ws_stream', {'stream': self.stream_id, 'seq': self.ws_seq}))
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line.startswith(WS_LINE_PREFIX):
+                    line = self._number_ws_event(line)
+                    if line is None:
+                        continue
+                    targets = list(self.peers)  # the publisher gets its own events back in order
+                else:
+                    targets = [peer for peer in self.peers if peer is not writer]
+                for peer in targets:
+                    self._enqueue(peer, line)
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            self.peers.pop(writer, None)
+            writer_task.cancel()
+            writer.close()
+    
+    def _envelope(self, channel, message):
+        return (json.dumps({'ch': channel, 'msg': message}, default=str) + '\n').encode('utf-8')
+    
+    def _number_ws_event(self, line):
+        try:
+            envelope = json.loads(line)
+        except ValueError:
+            print("[BUS] X Dropping malformed ws event")
+            return None
+        self.ws_seq += 1
+        envelope['msg']['seq'] = self.ws_seq
+        return self._envelope('ws', envelope['msg'])
+    
+    def _enqueue(self, peer, line):
+        queue = self.peers.get(peer)
+        if queue is None:
+            return
+        if queue.qsize() >= BUS_PEER_QUEUE:
+            # A process this far behind is stuck; it reconnects and resyncs
+            print("[BUS] X Peer not reading, disconnecting it")
+            self.peers.pop(peer, None)
+            peer.close()
+            return
+        queue.put_nowait(line)
+    
+    async def _write_peer(self, writer, queue):
+        """One writer per peer, so a slow process only delays its own messages"""
+        try:
+            while True:
+                writer.write(await queue.get())
+                await writer.drain()
+        except ConnectionError:
+            self.peers.pop(writer, None)
+
+class UnixSocketBus(LocalEventBus):
+    """Bus client: handlers in this process run right away, the hub forwards to the others"""
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.reader = None
+        self.writer = None
+        self.reader_task = None
+    
+    async def start(self):
+        await self._connect()
+        self.reader_task = asyncio.create_task(self._read_loop())
+    
+    async def _connect(self):
+        while True:
+            try:
+                self.reader, self.writer = await asyncio.open_unix_connection(self.path, limit=BUS_MAX_MESSAGE)
+                return
+            except OSError:
+                await asyncio.sleep(0.5)
+    
+    async def publish(self, channel, message):
+        # WebSocket events come back from the hub numbered; only deliver them here directly
+        # while the hub is unreachable
+        if channel != 'ws' or self.writer is None:
+            await self.dispatch(channel, message)
+        if self.writer is None:
+            return  # reconnecting to the hub; other processes miss this one
+        self.writer.write((json.dumps({'ch': channel, 'msg': message}, default=str) + '\n').encode('utf-8'))
+        try:
+            await self.writer.drain()
+        except ConnectionError:
+            pass
+    
+    async def _read_loop(self):
+        while True:
+            try:
+                line = await self.reader.readline()
+            except (ConnectionError, ValueError):
+                line = b''
+            if not line:
+                print("[BUS] X Lost connection to hub, reconnecting")
+                self.writer = None
+                await self._connect()
+                continue
+            try:
+                envelope = json.loads(line)
+            except ValueError:
+                print("[BUS] X Skipping malformed message")
+                continue
+            await self.dispatch(envelope['ch'], envelope['msg'])
+
+event_bus = LocalEventBus()
+bot_in_process = True
+cache_handlers = {}  # cache name -> function(change)
+
+async def publish_cache_change(cache, change):
+    """Apply a change to an in-memory cache in every process"""
+    await event_bus.publish('cache', {'cache': cache, 'change': change})
+
+def apply_cache_change(message):
+    handler = cache_handlers.get(message['cache'])
+    if handler:
+        return handler(message['change'])
+
+def attach_event_bus(bus, runs_bot):
+    global event_bus
+    event_bus = bus
+    bus.subscribe('ws', deliver_broadcast)
+    bus.subscribe('ws_stream', set_ws_stream)
+    bus.subscribe('cache', apply_cache_change)
+    bus.subscribe('guild_state', guild_registry.apply)
+    bus.subscribe('bot_reply', resolve_bot_call)
+    global bot_in_process
+    bot_in_process = runs_bot
+    if runs_bot:
+        bus.subscribe('bot_command', lambda message: asyncio.create_task(run_bot_command(message)))
+        bus.subscribe('guild_state_request', lambda message: publish_guild_snapshot())
+
+async def wait_for_parent_exit():
+    """Returns once the process that spawned this one is gone"""
+    parent = multiprocessing.parent_process()
+    while parent is None or parent.is_alive():
+        await asyncio.sleep(5)
+
+# --- BOT <-> WEB ---
+# The web tier never touches discord.py objects directly: the bot publishes guild state
+# changes and the web side sends it commands, so both can live in separate processes.
+pending_bot_calls = {}  # call id -> Future
+bot_commands = {}  # command name -> async function(**args)
+dirty_member_counts = set()  # guild ids waiting to publish a member count
+member_count_task = None
+
+class BotCommandError(Exception):
+    pass
+
+class GuildRegistry:
+    """Web-side view of the bot's guilds, with global, per-shard and per-folder totals kept incrementally"""
+    def __init__(self):
+        self.guilds = {}  # guild id -> server dict as served by /api/servers
+        self.shards = {}  # shard id -> {'latency', 'ready', 'received_at'}
+        self.total_members = 0
+        self.shard_totals = {}  # shard id -> [members, servers]
+        self.folder_totals = {}  # folder id -> [members, servers]
+        self._servers_json = None
+    
+    def apply(self, message):
+        """Bus handler for 'guild_state' messages published by the bot"""
+        op = message['op']
+        if op == 'full':
+            # A full list only replaces the shards its sender runs
+            covered = {shard['id'] for shard in message['shards']}
+            for guild_id in [g for g, guild in self.guilds.items() if guild['shard_id'] in covered]:
+                self._discard(guild_id)
+            for guild in message['guilds']:
+                self._add(guild)
+        elif op == 'upsert':
+            self._discard(int(message['guild']['id']))
+            self._add(message['guild'])
+        elif op == 'remove':
+            self._discard(message['id'])
+        elif op == 'members':
+            for guild_id, count in message['counts']:
+                guild = self.guilds.get(guild_id)
+                if guild:
+                    self._adjust(guild, (count or 0) - (guild['member_count'] or 0), 0)
+                    guild['member_count'] = count
+        now = time.monotonic()
+        for shard in message['shards']:
+            self.shards[shard['id']] = {'latency': shard['latency'], 'ready': shard['ready'], 'received_at': now}
+        if op != 'status':
+            self._servers_json = None
+    
+    def _add(self, guild):
+        self.guilds[int(guild['id'])] = guild
+        self._adjust(guild, guild['member_count'] or 0, 1)
+    
+    def _discard(self, guild_id):
+        guild = self.guilds.pop(guild_id, None)
+        if guild:
+            self._adjust(guild, -(guild['member_count'] or 0), -1)
+    
+    def _adjust(self, guild, members, servers):
+        self.total_members += members
+        totals = self.shard_totals.setdefault(guild['shard_id'], [0, 0])
+        totals[0] += members
+        totals[1] += servers
+        for folder_id in server_folder_ids.get(int(guild['id']), ()):
+            totals = self.folder_totals.setdefault(folder_id, [0, 0])
+            totals[0] += members
+            totals[1] += servers
+    
+    def folder_changed(self, folder_id, server_id, linked):
+        """Keep folder totals right when a server joins or leaves a folder"""
+        guild = self.guilds.get(server_id)
+        if guild:
+            sign = 1 if linked else -1
+            totals = self.folder_totals.setdefault(folder_id, [0, 0])
+            totals[0] += sign * (guild['member_count'] or 0)
+            totals[1] += sign
+    
+    def folder_deleted(self, folder_id):
+        self.folder_totals.pop(folder_id, None)
+    
+    def servers_json(self):
+        if self._servers_json is None:
+            self._servers_json = json.dumps(list(self.guilds.values()))
+        return self._servers_json
+    
+    def stats(self, folder_id=None):
+        """(total members, servers) overall or for one folder"""
+        if folder_id is None:
+            return self.total_members, len(self.guilds)
+        members, servers = self.folder_totals.get(folder_id, (0, 0))
+        return members, servers
+    
+    def shard_stats(self):
+        return [
+            {'id': shard_id, 'totalMembers': members, 'activeServers': servers}
+            for shard_id, (members, servers) in sorted(self.shard_totals.items())
+        ]
+    
+    def shard_status(self, shard_id):
+        """'online', 'connecting', or 'offline' when its process stopped reporting"""
+        shard = self.shards[shard_id]
+        if time.monotonic() - shard['received_at'] > 3 * GUILD_SNAPSHOT_INTERVAL:
+            return 'offline'
+        return 'online' if shard['ready'] else 'connecting'
+    
+    def status(self):
+        """Overall status; 'degraded' when only some shards are online"""
+        statuses = {self.shard_status(shard_id) for shard_id in self.shards}
+        if not statuses:
+            return 'connecting'
+        if len(statuses) == 1:
+            return statuses.pop()
+        return 'degraded' if 'online' in statuses else 'connecting'
+    
+    def latency(self):
+        """Average latency of the online shards"""
+        latencies = [shard['latency'] for shard_id, shard in self.shards.items() if self.shard_status(shard_id) == 'online']
+        return round(sum(latencies) / len(latencies)) if latencies else 0
+    
+    def shard_report(self):
+        return [
+            {
+                'id': shard_id,
+                'status': self.shard_status(shard_id),
+                'latency': shard['latency'],
+                'guilds': self.shard_totals.get(shard_id, (0, 0))[1]
+            }
+            for shard_id, shard in sorted(self.shards.items())
+        ]
+
+guild_registry = GuildRegistry()
+memory_reporters['guild_registry'] = lambda: {
+    'guilds': len(guild_registry.guilds),
+    'servers_json_bytes': len(guild_registry._servers_json or ''),
+    'folder_totals': len(guild_registry.folder_totals)
+}
+
+def bot_latency_ms(latency=None):
+    latency = bot.latency if latency is None else latency
+    return round(latency * 1000) if bot.is_ready() and math.isfinite(latency) else 0
+
+def shard_states(shard_ids=None):
+    """Connection state of the shards this process runs"""
+    if not SHARDED:
+        return [{'id': 0, 'latency': bot_latency_ms(), 'ready': bot.is_ready()}]
+    return [
+        {'id': shard_id, 'latency': bot_latency_ms(shard.latency), 'ready': bot.is_ready() and not shard.is_closed()}
+        for shard_id, shard in bot.shards.items()
+        if shard_ids is None or shard_id in shard_ids
+    ]
+
+def owns_shard(shard_id):
+    if not SHARDED:
+        return True
+    owned = bot.shard_ids if bot.shard_ids is not None else range(bot.shard_count or 1)
+    return shard_id in owned
+
+def guild_entry(guild):
+    return {
+        'id': str(guild.id),
+        'name': guild.name,
+        'icon': str(guild.icon.url) if guild.icon else None,
+        'member_count': guild.member_count,
+        'shard_id': guild.shard_id
+    }
+
+async def publish_guild_state(op, shard_ids=None, **fields):
+    await event_bus.publish('guild_state', {'op': op, 'shards': shard_states(shard_ids), **fields})
+
+async def publish_guild_snapshot(shard_ids=None):
+    """Full state of some or all of this process's shards, sent on ready and when a new web worker asks for it"""
+    guilds = [guild_entry(g) for g in bot.guilds if shard_ids is None or g.shard_id in shard_ids]
+    await publish_guild_state('full', shard_ids, guilds=guilds)
+
+async def publish_bot_status():
+    """Latency heartbeat; guild changes are published as they happen"""
+    while True:
+        await publish_guild_state('status')
+        await asyncio.sleep(GUILD_SNAPSHOT_INTERVAL)
+
+def member_count_changed(guild):
+    """Batch member count updates so a join flood costs one bus message per second"""
+    global member_count_task
+    dirty_member_counts.add(guild.id)
+    if member_count_task is None:
+        member_count_task = asyncio.create_task(flush_member_counts())
+
+async def flush_member_counts():
+    global member_count_task
+    await asyncio.sleep(1)
+    member_count_task = None
+    counts = []
+    for guild_id in dirty_member_counts:
+        guild = bot.get_guild(guild_id)
+        if guild:
+            counts.append([guild_id, guild.member_count])
+    dirty_member_counts.clear()
+    await publish_guild_state('members', counts=counts)
+    await publish_stats()
+
+async def bot_rpc(command, timeout=15, shard_id=0, **args):
+    """Run a command in the process that hosts the given shard and wait for its result"""
+    call_id = uuid.uuid4().hex
+    future = asyncio.get_running_loop().create_future()
+    pending_bot_calls[call_id] = future
+    try:
+        await event_bus.publish('bot_command', {'id': call_id, 'command': command, 'shard': shard_id, 'args': args})
+        return await asyncio.wait_for(future, timeout)
+    finally:
+        pending_bot_calls.pop(call_id, None)
+
+def resolve_bot_call(message):
+    future = pending_bot_calls.get(message['id'])
+    if future is None or future.done():
+        return
+    if 'error' in message:
+        future.set_exception(BotCommandError(message['error']))
+    else:
+        future.set_result(message['result'])
+
+async def run_bot_command(message):
+    if not owns_shard(message['shard']):
+        return  # another bot process answers
+    handler = bot_commands.get(message['command'])
+    try:
+        if handler is None:
+            raise BotCommandError(f"Unknown command: {message['command']}")
+        if not bot.is_ready():
+            raise BotCommandError('Bot is not connected')
+        reply = {'id': message['id'], 'result': await handler(**message['args'])}
+    except Exception as e:
+        reply = {'id': message['id'], 'error': str(e)}
+    await event_bus.publish('bot_reply', reply)
+
+async def bot_send_message(content, channel_id=None, user_id=None):
+    if channel_id:
+        target = bot.get_channel(int(channel_id)) or await bot.fetch_channel(int(channel_id))
+    elif user_id:
+        target = await bot.fetch_user(int(user_id))
+    else:
+        raise BotCommandError('channelId or userId required')
+    sent = await outbound.send(target.id, 'notice', target.send, content)
+    return {'messageId': str(sent.id), 'jumpUrl': sent.jump_url}
+
+bot_commands['send_message'] = bot_send_message
+
+# --- BROADCAST ---
+
+def broadcast_channel(guild, channel_name=None):
+    """The channel a server gets broadcasts in: by name if given, else the system channel,
+    else the first text channel the bot can post in"""
+    me = guild.me
+    candidates = guild.text_channels
+    if channel_name:
+        candidates = [c for c in candidates if c.name == channel_name.lstrip('#')]
+    elif guild.system_channel:
+        candidates = [guild.system_channel] + candidates
+    for channel in candidates:
+        if channel.permissions_for(me).send_messages:
+            return channel
+    return None
+
+async def deliver_broadcast_message(channel, content, pace):
+    """Send with retries on server and connection errors; returns (status, message id, error).
+    Rate limits are left to discord.py, which already waits out 429s before raising"""
+    attempts = max(1, BROADCAST_RETRIES)
+    for attempt in range(attempts):
+        await pace()
+        try:
+            sent = await outbound.send(channel.id, 'bulk', channel.send, content)
+            return 'sent', str(sent.id), None
+        except (discord.Forbidden, discord.NotFound) as e:
+            return 'failed', None, e.text or str(e.status)
+        except OutboundQueueFull:
+            return 'failed', None, 'Outbound queue full'
+        except discord.HTTPException as e:
+            error = e.text or str(e.status)
+            if e.status < 500:
+                return 'failed', None, error
+        except (aiohttp.ClientError, OSError) as e:
+            error = str(e) or type(e).__name__
+        if attempt + 1 < attempts:
+            await asyncio.sleep(2 ** attempt)
+    return 'failed', None, error
+
+async def bot_broadcast(content, server_ids=(), channel_ids=(), channel_name=None):
+    """Deliver to the servers and channels this process hosts; one send per channel,
+    BROADCAST_CONCURRENCY at a time, paced at BROADCAST_RATE"""
+    results = []
+    targets = {}  # channel id -> (channel, server id)
+    for server_id in server_ids:
+        guild = bot.get_guild(int(server_id))
+        channel = broadcast_channel(guild, channel_name) if guild else None
+        if channel is None:
+            results.append({'serverId': str(server_id), 'channelId': None,
+                            'status': 'not_found' if guild is None else 'no_channel'})
+        else:
+            targets[channel.id] = (channel, guild.id)
+    for channel_id in channel_ids:
+        channel = bot.get_channel(int(channel_id))
+        if channel is None:
+            results.append({'serverId': None, 'channelId': str(channel_id), 'status': 'not_found'})
+        else:
+            targets[channel.id] = (channel, channel.guild.id if getattr(channel, 'guild', None) else None)
+    
+    # Every channel is its own rate limit bucket, so the shared pace only guards the global limit
+    pacer = Pacer(BROADCAST_RATE)
+    
+    semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+    async def deliver(channel, server_id):
+        async with semaphore:
+            status, message_id, error = await deliver_broadcast_message(channel, content, pacer.wait)
+        result = {'serverId': str(server_id) if server_id else None, 'channelId': str(channel.id), 'status': status}
+        if message_id:
+            result['messageId'] = message_id
+        if error:
+            result['error'] = error
+        return result
+    
+    results.extend(await asyncio.gather(*(deliver(channel, server_id) for channel, server_id in targets.values())))
+    return {'results': results}
+
+bot_commands['broadcast'] = bot_broadcast
+
+def snowflake_list(value):
+    """Ids from a JSON list of numbers or digit strings; None if anything else is in it"""
+    if value is None:
+        return []
+    if not isinstance(value, list) or not all(str(v).isdigit() for v in value):
+        return None
+    return [int(v) for v in value]
+
+async def run_broadcast(content, server_ids=(), channel_ids=(), channel_name=None):
+    """Fan a broadcast out to every bot process and merge the delivery reports"""
+    server_ids = {int(s) for s in server_ids}
+    channel_ids = {int(c) for c in channel_ids}
+    blocks = bot_process_shards()
+    if blocks == [None]:
+        calls = [(0, server_ids, channel_ids)]
+    else:
+        # Servers go to the process hosting their shard, channels to every process
+        calls = []
+        for block in blocks:
+            owned = {s for s in server_ids
+                     if s in guild_registry.guilds and guild_registry.guilds[s]['shard_id'] in block}
+            calls.append((block[0], owned, channel_ids))
+            server_ids -= owned
+        if server_ids:
+            calls.append((blocks[0][0], server_ids, set()))  # reported back as not found
+    
+    timeout = 15 + sum(len(s) + len(c) for _, s, c in calls) / BROADCAST_RATE * max(1, BROADCAST_RETRIES)
+    replies = await asyncio.gather(*(
+        bot_rpc('broadcast', timeout=timeout, shard_id=shard_id, content=content, server_ids=[str(s) for s in servers],
+                channel_ids=[str(c) for c in channels], channel_name=channel_name)
+        for shard_id, servers, channels in calls if servers or channels
+    ), return_exceptions=True)
+    
+    # A channel outside a process's shards comes back not_found from that process
+    rank = {'sent': 3, 'failed': 2, 'no_channel': 1, 'not_found': 0}
+    merged, errors = {}, []
+    for reply in replies:
+        if isinstance(reply, BaseException):
+            errors.append('Bot did not respond' if isinstance(reply, asyncio.TimeoutError) else str(reply))
+            continue
+        for result in reply['results']:
+            key = result['channelId'] or ('server', result['serverId'])
+            if key not in merged or rank[result['status']] > rank[merged[key]['status']]:
+                merged[key] = result
+    results = list(merged.values())
+    report = {'sent': sum(r['status'] == 'sent' for r in results), 'failed': sum(r['status'] != 'sent' for r in results),
+              'results': results}
+    if errors:
+        report['errors'] = errors
+    return report
+
+# --- MEMBER CACHE ---
+chunk_tasks = {}  # guild id -> in-flight chunk task
+
+async def ensure_guild_chunked(guild):
+    """Load a guild's member list once, the first time something needs it (MEMBER_CHUNKING=lazy)"""
+    if guild is None or guild.chunked or MEMBER_CHUNKING != 'lazy':
+        return
+    task = chunk_tasks.get(guild.id)
+    if task is None:
+        task = chunk_tasks[guild.id] = asyncio.create_task(guild.chunk())
+        task.add_done_callback(lambda _: chunk_tasks.pop(guild.id, None))
+        print(f"[BOT] + Chunking {guild.name} ({guild.member_count} members)")
+    await asyncio.shield(task)
+
+def members_loaded():
+    """Command check that chunks the guild before member arguments are converted; put it
+    below the permission checks so only members allowed to run the command can trigger it"""
+    async def predicate(ctx):
+        await ensure_guild_chunked(ctx.guild)
+        return True
+    return commands.check(predicate)
+
+def discord_cache_sizes():
+    return {
+        'guilds': len(bot.guilds),
+        'chunked_guilds': sum(1 for g in bot.guilds if g.chunked),
+        'members': sum(len(g.members) for g in bot.guilds),
+        'users': len(bot.users),
+        'messages': len(bot.cached_messages),
+        'max_messages': MESSAGE_CACHE_SIZE,
+        'member_cache': MEMBER_CACHE,
+        'chunking': MEMBER_CHUNKING
+    }
+
+memory_reporters['discord'] = discord_cache_sizes
+
+def memory_report():
+    report = {name: reporter() for name, reporter in memory_reporters.items()}
+    if resource:
+        report['process'] = {'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+    return report
+
+async def bot_memory_report():
+    report = memory_report()
+    return {'discord': report['discord'], 'bot_process': report.get('process')}
+
+bot_commands['memory_report'] = bot_memory_report
+
+# --- MEME HASHING ---
+# 64-bit DCT perceptual hash; near-duplicates differ in only a few bits
+PHASH_MASK = (1 << 64) - 1
+_DCT_COS = [[math.cos((2 * x + 1) * u * math.pi / 64) for x in range(32)] for u in range(8)]
+
+def compute_phash(path):
+    """Perceptual hash of an image file (runs in a worker process)"""
+    with Image.open(path) as img:
+        img = img.convert('L').resize((32, 32), Image.LANCZOS)
+        pixels = list(img.getdata())
+    
+    # Separable 2D DCT-II, keeping only the 8x8 low frequency block
+    rows = [[sum(pixels[y * 32 + x] * _DCT_COS[u][x] for x in range(32)) for u in range(8)] for y in range(32)]
+    coeffs = [sum(rows[y][u] * _DCT_COS[v][y] for y in range(32)) for v in range(8) for u in range(8)]
+    
+    median = sorted(coeffs[1:])[31]  # DC term excluded
+    value = 0
+    for c in coeffs:
+        value = (value << 1) | (c > median)
+    return value
+
+def hamming(a, b):
+    return bin((a ^ b) & PHASH_MASK).count('1')
+
+def phash_to_db(value):
+    """SQLite integers are signed 64-bit"""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+def phash_from_db(value):
+    return value & PHASH_MASK
+
+class BKTree:
+    """BK-tree over 64-bit hashes, searched by Hamming distance"""
+    def __init__(self):
+        self.root = None  # node: [hash, set of ids, {distance: child}]
+        self.size = 0
+    
+    def add(self, value, item_id):
+        self.size += 1
+        if self.root is None:
+            self.root = [value, {item_id}, {}]
+            return
+        node = self.root
+        while True:
+            d = hamming(value, node[0])
+            if d == 0:
+                node[1].add(item_id)
+                return
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [value, {item_id}, {}]
+                return
+            node = child
+    
+    def remove(self, value, item_id):
+        # Nodes stay in place as routing points; only the id is dropped
+        node = self.root
+        while node is not None:
+            d = hamming(value, node[0])
+            if d == 0:
+                if item_id in node[1]:
+                    node[1].discard(item_id)
+                    self.size -= 1
+                return
+            node = node[2].get(d)
+    
+    def search(self, value, radius):
+        """Return (distance, id) pairs within radius, closest first"""
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            d = hamming(value, node[0])
+            if d <= radius:
+                found.extend((d, item_id) for item_id in node[1])
+            for child_d, child in node[2].items():
+                if d - radius <= child_d <= d + radius:
+                    stack.append(child)
+        found.sort()
+        return found
+
+meme_index = BKTree()
+meme_hashes = {}  # meme id -> phash
+phash_pool = None
+
+def index_meme(meme_id, value):
+    if meme_id in meme_hashes:
+        meme_index.remove(meme_hashes[meme_id], meme_id)
+    meme_hashes[meme_id] = value
+    meme_index.add(value, meme_id)
+
+def unindex_meme(meme_id):
+    value = meme_hashes.pop(meme_id, None)
+    if value is not None:
+        meme_index.remove(value, meme_id)
+
+def apply_meme_hash_change(change):
+    if change['op'] == 'add':
+        index_meme(change['id'], change['phash'])
+    elif change['op'] == 'remove':
+        unindex_meme(change['id'])
+
+cache_handlers['meme_hashes'] = apply_meme_hash_change
+memory_reporters['meme_index'] = lambda: {'hashes': len(meme_hashes)}
+
+async def hash_meme_file(filepath):
+    """Compute a meme's phash in the process pool; None if it can't be decoded"""
+    global phash_pool
+    if Image is None:
+        return None
+    if phash_pool is None:
+        phash_pool = ProcessPoolExecutor(max_workers=PHASH_WORKERS)
+    try:
+        return await asyncio.get_running_loop().run_in_executor(phash_pool, compute_phash, filepath)
+    except Exception as e:
+        print(f"[MEME] X Could not hash {os.path.basename(filepath)}: {e}")
+        return None
+
+async def load_meme_hashes():
+    """Build the in-memory BK-tree from stored hashes"""
+    cursor = await db_conn.execute("SELECT id, phash FROM memes WHERE phash IS NOT NULL")
+    for r in await cursor.fetchall():
+        index_meme(r['id'], phash_from_db(r['phash']))
+    print(f"[MEME] + Indexed {meme_index.size} meme hashes")
+    if Image is None:
+        print("[MEME] X Pillow not installed - repost detection disabled")
+
+async def backfill_meme_hashes():
+    """Hash memes uploaded before repost detection existed"""
+    if Image is None:
+        return
+    cursor = await db_conn.execute("SELECT id, image_path FROM memes WHERE phash IS NULL")
+    rows = await cursor.fetchall()
+    for r in rows:
+        filepath = os.path.join(UPLOADS_PATH, os.path.basename(r['image_path']))
+        if not os.path.exists(filepath):
+            continue
+        value = await hash_meme_file(filepath)
+        if value is None:
+            continue
+        await db_conn.execute("UPDATE memes SET phash = ? WHERE id = ?", (phash_to_db(value), r['id']))
+        await db_conn.commit()
+        await publish_cache_change('meme_hashes', {'op': 'add', 'id': r['id'], 'phash': value})
+
+# --- MEME POOL ---
+# Meme ids for the meme command, loaded only where the bot runs
+
+class MemePool:
+    """Meme ids in an array (swap-remove) for O(1) uniform picks, plus a Fenwick tree over
+    the same slots for O(log n) like-weighted picks"""
+    def __init__(self):
+        self.ids = []
+        self.slots = {}  # meme id -> index in ids
+        self.weights = []
+        self.tree = [0]  # 1-based Fenwick tree over weights
+        self.recent = OrderedDict()  # channel id -> deque of recently sent ids
+        self.loaded = False
+    
+    def __len__(self):
+        return len(self.ids)
+    
+    def _prefix(self, i):
+        total = 0
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+    
+    def _update(self, slot, delta):
+        i = slot + 1
+        while i < len(self.tree):
+            self.tree[i] += delta
+            i += i & -i
+    
+    def add(self, meme_id, likes=0):
+        if meme_id in self.slots:
+            return self.set_likes(meme_id, likes)
+        weight = 1 + max(0, likes)
+        self.slots[meme_id] = len(self.ids)
+        self.ids.append(meme_id)
+        self.weights.append(weight)
+        # The new node covers (i - lowbit(i), i]
+        i = len(self.tree)
+        self.tree.append(weight + self._prefix(i - 1) - self._prefix(i - (i & -i)))
+    
+    def remove(self, meme_id):
+        slot = self.slots.pop(meme_id, None)
+        if slot is None:
+            return
+        last = len(self.ids) - 1
+        if slot != last:
+            moved = self.ids[last]
+            self._update(slot, self.weights[last] - self.weights[slot])
+            self.ids[slot] = moved
+            self.weights[slot] = self.weights[last]
+            self.slots[moved] = slot
+        # Dropping the last node leaves every earlier node's range intact
+        self.ids.pop()
+        self.weights.pop()
+        self.tree.pop()
+    
+    def set_likes(self, meme_id, likes):
+        slot = self.slots.get(meme_id)
+        if slot is None:
+            return
+        weight = 1 + max(0, likes)
+        self._update(slot, weight - self.weights[slot])
+        self.weights[slot] = weight
+    
+    def _find(self, target):
+        """Fenwick descent to the slot holding unit `target` of the total weight"""
+        pos = 0
+        step = 1 << (len(self.tree) - 1).bit_length()
+        while step:
+            nxt = pos + step
+            if nxt < len(self.tree) and self.tree[nxt] <= target:
+                pos = nxt
+                target -= self.tree[nxt]
+            step >>= 1
+        return pos
+    
+    def _uniform_slot(self, excluded):
+        """Uniform over the slots not in excluded (sorted)"""
+        slot = random.randrange(len(self.ids) - len(excluded))
+        for skip in excluded:
+            if skip > slot:
+                break
+            slot += 1
+        return slot
+    
+    def _weighted_slot(self, excluded):
+        """Weighted over the slots not in excluded (sorted): draw from the remaining weight and
+        shift the target past the excluded weight that lies before the slot it lands on"""
+        target = random.randrange(self._prefix(len(self.ids)) - sum(self.weights[i] for i in excluded))
+        skipped = 0
+        while True:
+            slot = self._find(target + skipped)
+            before = sum(self.weights[i] for i in excluded if i <= slot)
+            if before == skipped:
+                return slot
+            skipped = before
+    
+    def pick(self, channel_id, weighted=False):
+        """A meme id not among the channel's last MEME_NO_REPEAT (or all but one, for a smaller
+        pool), None if the pool is empty"""
+        if not self.ids:
+            return None
+        recent = self.recent.get(channel_id)
+        if recent is None:
+            recent = self.recent[channel_id] = deque(maxlen=MEME_NO_REPEAT)
+            if len(self.recent) > 10000:
+                self.recent.popitem(last=False)
+        self.recent.move_to_end(channel_id)
+        keep = min(len(recent), len(self.ids) - 1)
+        excluded = sorted({self.slots[m] for m in list(recent)[len(recent) - keep:] if m in self.slots})
+        slot = self._weighted_slot(excluded) if weighted else self._uniform_slot(excluded)
+        meme_id = self.ids[slot]
+        if recent.maxlen:
+            recent.append(meme_id)
+        return meme_id
+
+meme_pool = MemePool()
+
+def apply_meme_pool_change(change):
+    if not meme_pool.loaded:
+        return
+    if change['op'] == 'add':
+        meme_pool.add(change['id'])
+    elif change['op'] == 'remove':
+        meme_pool.remove(change['id'])
+    elif change['op'] == 'likes':
+        for meme_id, likes in change['counts']:
+            meme_pool.set_likes(meme_id, likes)
+
+cache_handlers['meme_pool'] = apply_meme_pool_change
+memory_reporters['meme_pool'] = lambda: {'memes': len(meme_pool), 'channels': len(meme_pool.recent)}
+
+async def load_meme_pool():
+    cursor = await db_conn.execute("SELECT id, like_count FROM memes")
+    for r in await cursor.fetchall():
+        meme_pool.add(r['id'], r['like_count'])
+    meme_pool.loaded = True
+    print(f"[MEME] + Loaded {len(meme_pool)} memes for the meme command")
+
+# --- FOLDER INDEX ---
+# Which folders each server belongs to, so per-message work needs no query
+
+def index_server_folder(folder_id, server_id):
+    folder_servers.setdefault(folder_id, set()).add(server_id)
+    server_folder_ids.setdefault(server_id, set()).add(folder_id)
+
+def unindex_server_folder(folder_id, server_id):
+    folder_servers.get(folder_id, set()).discard(server_id)
+    folders = server_folder_ids.get(server_id)
+    if folders is not None:
+        folders.discard(folder_id)
+        if not folders:
+            del server_folder_ids[server_id]
+
+def unindex_folder(folder_id):
+    for server_id in list(folder_servers.get(folder_id, ())):
+        unindex_server_folder(folder_id, server_id)
+    folder_servers.pop(folder_id, None)
+
+def apply_server_folder_change(change):
+    folder_id = change['folder_id']
+    if change['op'] == 'add':
+        if folder_id not in server_folder_ids.get(change['server_id'], ()):
+            index_server_folder(folder_id, change['server_id'])
+            guild_registry.folder_changed(folder_id, change['server_id'], True)
+    elif change['op'] == 'remove':
+        if folder_id in server_folder_ids.get(change['server_id'], ()):
+            unindex_server_folder(folder_id, change['server_id'])
+            guild_registry.folder_changed(folder_id, change['server_id'], False)
+    elif change['op'] == 'delete_folder':
+        unindex_folder(folder_id)
+        guild_registry.folder_deleted(folder_id)
+
+cache_handlers['server_folders'] = apply_server_folder_change
+memory_reporters['server_folders'] = lambda: {
+    'folders': len(folder_servers),
+    'links': sum(len(servers) for servers in folder_servers.values())
+}
+
+async def load_server_folders():
+    folder_servers.clear()
+    server_folder_ids.clear()
+    cursor = await db_conn.execute(
+        "SELECT sf.folder_id, sf.server_id FROM server_folders sf JOIN folders f ON f.id = sf.folder_id"
+    )
+    for r in await cursor.fetchall():
+        index_server_folder(r['folder_id'], r['server_id'])
+
 # --- WEB SERVER ---
 routes = web.RouteTableDef()
 
@@ -195,7 +1405,7 @@ def cors_headers():
     return {
         'Access-Control-Allow-Origin': '*',
         'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, PATCH, OPTIONS',
-        'Access-Control-Allow-Headers': 'Content-Type, Authorization',
+        'Access-Control-Allow-Headers': 'Content-Type, Authorization, X-User-Id',
         'Access-Control-Allow-Credentials': 'true'
     }
 
@@ -207,6 +1417,19 @@ def json_response(data, status=200):
         headers=cors_headers()
     )
 
+def admin_only(handler):
+    """Mark a route as admin-only for admin_middleware"""
+    handler.admin_only = True
+    return handler
+
+@web.middleware
+async def admin_middleware(request, handler):
+    if REQUIRE_API_ADMIN and getattr(handler, 'admin_only', False):
+        user_id = request.headers.get('X-User-Id', '')
+        if not (user_id.isdigit() and is_bot_admin(int(user_id))):
+            return json_response({'error': 'Admin access required'}, 403)
+    return await handler(request)
+
 # --- API ENDPOINTS ---
 
 @routes.options('/{tail:.*}')
@@ -216,10 +1439,13 @@ async def handle_options(request):
 # Status
 @routes.get('/api/status')
 async def handle_status(request):
+    status = guild_registry.status()
+    online = status in ('online', 'degraded')
     return json_response({
-        'status': 'online' if bot.is_ready() else 'connecting',
-        'latency': round(bot.latency * 1000) if bot.is_ready() else 0,
-        'guilds': len(bot.guilds) if bot.is_ready() else 0,
+        'status': status,
+        'latency': guild_registry.latency() if online else 0,
+        'guilds': len(guild_registry.guilds) if online else 0,
+        'shards': guild_registry.shard_report(),
         'uptime': '99.9%'
     })
 
@@ -228,48 +1454,71 @@ async def handle_status(request):
 async def handle_stats(request):
     folder_id = request.query.get('folderId')
     
-    total_members = 0
-    active_servers = 0
-    
     if folder_id and folder_id.isdigit():
-        # Get servers in this folder
-        cursor = await db_conn.execute(
-            "SELECT server_id FROM server_folders WHERE folder_id = ?", 
-            (int(folder_id),)
-        )
-        rows = await cursor.fetchall()
-        server_ids = set(r['server_id'] for r in rows)
-        
-        # Sum stats only for these servers
-        for guild in bot.guilds:
-            if guild.id in server_ids:
-                total_members += guild.member_count or 0
-                active_servers += 1
+        total_members, active_servers = guild_registry.stats(int(folder_id))
+        shards = None
     else:
-        # Global stats (no folder filter)
-        for guild in bot.guilds:
-            total_members += guild.member_count or 0
-            active_servers += 1
+        total_members, active_servers = guild_registry.stats()
+        shards = guild_registry.shard_stats()
     
-    return json_response({
+    stats = {
         'totalMembers': total_members,
         'activeServers': active_servers,
         'commandsToday': 0,
         'uptime': '99.9%'
-    })
+    }
+    if shards is not None:
+        stats['shards'] = shards
+    return json_response(stats)
 
 # Servers
 @routes.get('/api/servers')
 async def handle_servers(request):
-    servers = []
-    for guild in bot.guilds:
-        servers.append({
-            'id': str(guild.id),
-            'name': guild.name,
-            'icon': str(guild.icon.url) if guild.icon else None,
-            'member_count': guild.member_count
-        })
-    return json_response(servers)
+    return web.Response(
+        text=guild_registry.servers_json(),
+        content_type='application/json',
+        headers=cors_headers()
+    )
+
+# Send a message through the bot
+@routes.post('/api/send')
+@admin_only
+async def handle_send(request):
+    data = await request.json()
+    content = data.get('content')
+    if not content:
+        return json_response({'error': 'Content required'}, 400)
+    
+    try:
+        result = await bot_rpc('send_message', content=content, channel_id=data.get('channelId'), user_id=data.get('userId'))
+    except asyncio.TimeoutError:
+        return json_response({'error': 'Bot did not respond'}, 504)
+    except BotCommandError as e:
+        return json_response({'error': str(e)}, 400)
+    
+    return json_response({'success': True, **result})
+
+@routes.post('/api/broadcast')
+@admin_only
+async def handle_broadcast(request):
+    data = await request.json()
+    content = data.get('content')
+    if not content:
+        return json_response({'error': 'Content required'}, 400)
+    
+    server_ids = snowflake_list(data.get('serverIds'))
+    channel_ids = snowflake_list(data.get('channelIds'))
+    folder_id = data.get('folderId')
+    if server_ids is None or channel_ids is None or (folder_id is not None and not str(folder_id).isdigit()):
+        return json_response({'error': 'folderId, serverIds and channelIds must be numeric ids'}, 400)
+    server_ids = set(server_ids)
+    if folder_id is not None:
+        server_ids |= folder_servers.get(int(folder_id), set())
+    if not server_ids and not channel_ids:
+        return json_response({'error': 'folderId, serverIds or channelIds required'}, 400)
+    
+    report = await run_broadcast(content, server_ids, channel_ids, data.get('channelName'))
+    return json_response({'success': True, **report})
 
 # --- AUTH ---
 @routes.post('/api/auth/login')
@@ -326,6 +1575,22 @@ async def handle_auth_login(request):
     })
 
 # --- ADMINS ---
+def is_bot_admin(user_id):
+    return user_id == OWNER_ID or user_id in admin_ids
+
+async def load_admins():
+    cursor = await db_conn.execute("SELECT user_id FROM bot_admins")
+    admin_ids.clear()
+    admin_ids.update(r['user_id'] for r in await cursor.fetchall())
+
+def apply_admin_change(change):
+    if change['op'] == 'add':
+        admin_ids.add(change['user_id'])
+    elif change['op'] == 'remove':
+        admin_ids.discard(change['user_id'])
+
+cache_handlers['admins'] = apply_admin_change
+
 @routes.get('/api/admins')
 async def handle_admins_get(request):
     admins = [{'user_id': str(OWNER_ID), 'username': 'Owner', 'role': 'owner', 'added_at': 'System', 'is_owner': True}]
@@ -346,6 +1611,7 @@ async def handle_admins_get(request):
     return json_response({'success': True, 'admins': admins})
 
 @routes.post('/api/admins')
+@admin_only
 async def handle_admins_add(request):
     data = await request.json()
     try:
@@ -358,11 +1624,13 @@ async def handle_admins_add(request):
             (user_id, username, role, datetime.now(timezone.utc).isoformat())
         )
         await db_conn.commit()
+        await publish_cache_change('admins', {'op': 'add', 'user_id': user_id})
         return json_response({'success': True})
     except:
         return json_response({'error': 'Invalid ID'}, 400)
 
 @routes.delete('/api/admins/{id}')
+@admin_only
 async def handle_admins_delete(request):
     user_id = int(request.match_info['id'])
     if user_id == OWNER_ID:
@@ -370,6 +1638,7 @@ async def handle_admins_delete(request):
     
     await db_conn.execute("DELETE FROM bot_admins WHERE user_id = ?", (user_id,))
     await db_conn.commit()
+    await publish_cache_change('admins', {'op': 'remove', 'user_id': user_id})
     return json_response({'success': True})
 
 # --- FOLDERS ---
@@ -428,16 +1697,17 @@ async def handle_folder_add_server(request):
     server_icon = data.get('serverIcon')
     
     # Try to get real server info from bot
-    guild = bot.get_guild(server_id)
+    guild = guild_registry.guilds.get(server_id)
     if guild:
-        server_name = guild.name
-        server_icon = str(guild.icon.url) if guild.icon else None
+        server_name = guild['name']
+        server_icon = guild['icon']
     
     await db_conn.execute(
         "INSERT OR REPLACE INTO server_folders (folder_id, server_id, server_name, server_icon) VALUES (?, ?, ?, ?)",
         (folder_id, server_id, server_name, server_icon)
     )
     await db_conn.commit()
+    await publish_cache_change('server_folders', {'op': 'add', 'folder_id': folder_id, 'server_id': server_id})
     
     return json_response({'success': True})
 
@@ -451,6 +1721,7 @@ async def handle_folder_remove_server(request):
         (folder_id, server_id)
     )
     await db_conn.commit()
+    await publish_cache_change('server_folders', {'op': 'remove', 'folder_id': folder_id, 'server_id': server_id})
     return json_response({'success': True})
 
 @routes.delete('/api/server-folders/{id}')
@@ -458,19 +1729,107 @@ async def handle_folder_delete(request):
     folder_id = int(request.match_info['id'])
     await db_conn.execute("DELETE FROM folders WHERE id = ?", (folder_id,))
     await db_conn.commit()
+    await publish_cache_change('server_folders', {'op': 'delete_folder', 'folder_id': folder_id})
     return json_response({'success': True})
 
-# --- LOGS ---
-@routes.get('/api/logs/messages')
-async def handle_logs_messages(request):
-    limit = int(request.query.get('limit', 50))
-    folder_id = request.query.get('folderId')
+# --- SAVED MESSAGES ---
+
+async def fetch_saved(saved_by, folder, cursor=None, limit=10):
+    """One page of a user's folder (saved_by None: legacy saves with no recorded saver), newest
+    first; cursor is 'timestamp|id' of the last row seen"""
+    owner = "saved_by IS NULL" if saved_by is None else "saved_by = ?"
+    params = [folder] if saved_by is None else [saved_by, folder]
+    after = ""
+    if cursor:
+        timestamp, _, last_id = cursor.rpartition('|')
+        after = "AND (timestamp, id) < (?, ?)"
+        params += [timestamp, int(last_id)]
+    rows = await (await db_conn.execute(f"""
+        SELECT id, user_id, username, content, timestamp, channel_id, message_id, guild_id FROM saved_msg
+        WHERE {owner} AND folder = ? {after}
+        ORDER BY timestamp DESC, id DESC LIMIT ?
+    """, (*params, limit + 1))).fetchall()
+    next_cursor = f"{rows[limit - 1]['timestamp']}|{rows[limit - 1]['id']}" if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+def saved_payload(r):
+    return {
+        'id': r['id'],
+        'userId': str(r['user_id']),
+        'username': r['username'],
+        'content': r['content'],
+        'timestamp': r['timestamp'],
+        'channelId': str(r['channel_id']) if r['channel_id'] else None,
+        'messageId': str(r['message_id']) if r['message_id'] else None,
+        'guildId': str(r['guild_id']) if r['guild_id'] else None
+    }
+
+def saved_owner(request):
+    """(ok, saved_by) from ?userId= or ?legacy=1"""
+    if request.query.get('legacy') in ('1', 'true'):
+        return True, None
+    user_id = request.query.get('userId')
+    if not user_id or not user_id.isdigit():
+        return False, None
+    return True, int(user_id)
+
+@routes.get('/api/saved')
+async def handle_saved_get(request):
+    ok, saved_by = saved_owner(request)
+    if not ok:
+        return json_response({'error': 'userId or legacy=1 required'}, 400)
+    limit = max(1, min(100, int(request.query.get('limit', 20))))
+    cursor = request.query.get('cursor')
+    if cursor and not cursor.rpartition('|')[2].isdigit():
+        return json_response({'error': 'Invalid cursor'}, 400)
     
-    if folder_id and folder_id.isdigit():
-        # Get server IDs for this folder
+    rows, next_cursor = await fetch_saved(saved_by, request.query.get('folder', 'default'), cursor, limit)
+    return json_response({'success': True, 'messages': [saved_payload(r) for r in rows],
+                          'nextCursor': next_cursor, 'hasMore': next_cursor is not None})
+
+@routes.get('/api/saved/folders')
+async def handle_saved_folders(request):
+    ok, saved_by = saved_owner(request)
+    if not ok:
+        return json_response({'error': 'userId or legacy=1 required'}, 400)
+    if saved_by is None:
         cursor = await db_conn.execute(
-            "SELECT server_id FROM server_folders WHERE folder_id = ?",
-            (int(folder_id),)
+            "SELECT folder, COUNT(*) AS count FROM saved_msg WHERE saved_by IS NULL GROUP BY folder ORDER BY folder"
+        )
+    else:
+        cursor = await db_conn.execute(
+            "SELECT folder, COUNT(*) AS count FROM saved_msg WHERE saved_by = ? GROUP BY folder ORDER BY folder",
+            (saved_by,)
+        )
+    return json_response({'success': True, 'folders': [{'name': r['folder'], 'count': r['count']} for r in await cursor.fetchall()]})
+
+@routes.delete('/api/saved/{id}')
+@admin_only
+async def handle_saved_delete(request):
+    saved_id = request.match_info['id']
+    if not saved_id.isdigit():
+        return json_response({'error': 'Invalid saved message id'}, 400)
+    saved_id = int(saved_id)
+    
+    cursor = await db_conn.execute("SELECT id FROM saved_msg WHERE id = ?", (saved_id,))
+    if not await cursor.fetchone():
+        return json_response({'error': 'Saved message not found'}, 404)
+    
+    await db_conn.execute("DELETE FROM saved_msg WHERE id = ?", (saved_id,))
+    await db_conn.commit()
+    return json_response({'success': True})
+
+# --- LOGS ---
+@routes.get('/api/logs/messages')
+async def handle_logs_messages(request):
+    limit = int(request.query.get('limit', 50))
+    folder_id = request.query.get('folderId')
+    
+    if folder_id and folder_id.isdigit():
+        # Get server IDs for this folder
+        cursor = await db_conn.execute(
+            "SELECT server_id FROM server_folders WHERE folder_id = ?",
+            (int(folder_id),)
         )
         folder_rows = await cursor.fetchall()
         server_ids = [r['server_id'] for r in folder_rows]
@@ -506,9 +1865,42 @@ async def handle_logs_messages(request):
     
     return json_response({'success': True, 'logs': logs, 'total': len(logs)})
 
+async def record_actions(rows):
+    """Queue action_logs rows (action, actor id, actor name, target type, target id, target name,
+    details, server id, server name); the caller commits"""
+    await db_conn.executemany("""
+        INSERT INTO action_logs (action_type, actor_id, actor_name, target_type, target_id, target_name, details, server_id, server_name)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, rows)
+
 @routes.get('/api/logs/actions')
 async def handle_logs_actions(request):
-    return json_response({'success': True, 'logs': [], 'total': 0})
+    limit = int(request.query.get('limit', 50))
+    cursor_id = request.query.get('cursor')
+    server_id = request.query.get('serverId')
+    action_type = request.query.get('actionType')
+    
+    conditions, params = [], []
+    if server_id:
+        conditions.append("server_id = ?")
+        params.append(server_id)
+    if action_type:
+        conditions.append("action_type = ?")
+        params.append(action_type)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    cursor = await db_conn.execute(f"SELECT COUNT(*) FROM action_logs {where}", params)
+    total = (await cursor.fetchone())[0]
+    
+    if cursor_id and cursor_id.isdigit():
+        conditions.append("id < ?")
+        params.append(int(cursor_id))
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    cursor = await db_conn.execute(f"SELECT * FROM action_logs {where} ORDER BY id DESC LIMIT ?", (*params, limit))
+    logs = [dict(r) for r in await cursor.fetchall()]
+    
+    next_cursor = logs[-1]['id'] if len(logs) == limit else None
+    return json_response({'success': True, 'logs': logs, 'total': total,
+                          'nextCursor': next_cursor, 'hasMore': next_cursor is not None})
 
 # --- MEMES ---
 @routes.get('/api/memes')
@@ -568,12 +1960,27 @@ async def handle_meme_upload(request):
     
     url = f"/uploads/{filename}"
     
+    # Repost detection
+    phash = await hash_meme_file(filepath)
+    repost_of = None
+    if phash is not None:
+        matches = meme_index.search(phash, MEME_REPOST_DISTANCE)
+        if matches:
+            distance, repost_of = matches[0]
+            if MEME_REPOST_MODE == 'reject':
+                os.remove(filepath)
+                return json_response({'error': 'Repost detected', 'duplicateOf': repost_of, 'distance': distance}, 409)
+    
     cursor = await db_conn.execute(
-        "INSERT INTO memes (image_path, caption, user_id) VALUES (?, ?, ?)",
-        (url, caption, user_id)
+        "INSERT INTO memes (image_path, caption, user_id, phash) VALUES (?, ?, ?, ?)",
+        (url, caption, user_id, phash_to_db(phash) if phash is not None else None)
     )
     await db_conn.commit()
     
+    if phash is not None:
+        await publish_cache_change('meme_hashes', {'op': 'add', 'id': cursor.lastrowid, 'phash': phash})
+    await publish_cache_change('meme_pool', {'op': 'add', 'id': cursor.lastrowid})
+    
     # Broadcast new meme
     await broadcast('new_meme', {'meme': {
         'id': cursor.lastrowid,
@@ -581,10 +1988,47 @@ async def handle_meme_upload(request):
         'caption': caption,
         'user_id': str(user_id),
         'like_count': 0,
-        'dislike_count': 0
-    }})
+        'dislike_count': 0,
+        'repost_of': repost_of
+    }}, ['memes'])
+    
+    return json_response({'success': True, 'meme': {'id': cursor.lastrowid, 'image_path': url}, 'repostOf': repost_of})
+
+@routes.get('/api/memes/{id}/similar')
+async def handle_meme_similar(request):
+    meme_id = request.match_info['id']
+    distance = request.query.get('distance', '10')
+    limit = request.query.get('limit', '20')
+    if not (meme_id.isdigit() and distance.isdigit() and limit.isdigit()):
+        return json_response({'error': 'id, distance and limit must be numbers'}, 400)
+    # Hashes are 64 bits, so 64 already matches everything
+    meme_id, distance, limit = int(meme_id), min(64, int(distance)), max(1, min(100, int(limit)))
+    
+    phash = meme_hashes.get(meme_id)
+    if phash is None:
+        return json_response({'error': 'Meme not found or not hashed'}, 404)
+    
+    matches = [(d, i) for d, i in meme_index.search(phash, distance) if i != meme_id][:limit]
+    if not matches:
+        return json_response({'success': True, 'similar': []})
+    
+    placeholders = ','.join('?' * len(matches))
+    cursor = await db_conn.execute(
+        f"SELECT id, image_path, caption, like_count, dislike_count FROM memes WHERE id IN ({placeholders})",
+        [i for _, i in matches]
+    )
+    rows = {r['id']: r for r in await cursor.fetchall()}
+    
+    similar = [{
+        'id': i,
+        'image_path': rows[i]['image_path'],
+        'caption': rows[i]['caption'],
+        'like_count': rows[i]['like_count'],
+        'dislike_count': rows[i]['dislike_count'],
+        'distance': d
+    } for d, i in matches if i in rows]
     
-    return json_response({'success': True, 'meme': {'id': cursor.lastrowid, 'image_path': url}})
+    return json_response({'success': True, 'similar': similar})
 
 @routes.post('/api/memes/{id}/vote')
 async def handle_meme_vote(request):
@@ -625,12 +2069,10 @@ async def handle_meme_vote(request):
     cursor = await db_conn.execute("SELECT like_count, dislike_count FROM memes WHERE id = ?", (meme_id,))
     meme = await cursor.fetchone()
     
-    # Broadcast vote update
-    await broadcast('vote_update', {
-        'memeId': meme_id,
-        'likeCount': meme['like_count'],
-        'dislikeCount': meme['dislike_count']
-    })
+    # Broadcast vote update (coalesced per meme)
+    vote_coalescer.add(meme_id, meme['like_count'], meme['dislike_count'])
+    if not VOTE_COALESCE_MS:
+        await vote_coalescer.flush()
     
     return json_response({'success': True, 'likeCount': meme['like_count'], 'dislikeCount': meme['dislike_count']})
 
@@ -654,8 +2096,10 @@ async def handle_meme_delete(request):
     
     await db_conn.execute("DELETE FROM memes WHERE id = ?", (meme_id,))
     await db_conn.commit()
+    await publish_cache_change('meme_hashes', {'op': 'remove', 'id': meme_id})
+    await publish_cache_change('meme_pool', {'op': 'remove', 'id': meme_id})
     
-    await broadcast('meme_deleted', {'memeId': meme_id})
+    await broadcast('meme_deleted', {'memeId': meme_id}, ['memes', f'meme:{meme_id}'])
     
     return json_response({'success': True})
 
@@ -697,80 +2141,1003 @@ async def handle_meme_of_day(request):
     })
 
 # --- BOT SETTINGS ---
+SETTING_DEFAULTS = {
+    'prefix': 'C7/',
+    'serverLogs': 'true',
+    'bigActions': 'true',
+    'autoModeration': 'false',
+    'welcomeMessages': 'false'
+}
+SETTING_FIELDS = {'commandPrefix': 'prefix', 'serverLogs': 'serverLogs', 'bigActions': 'bigActions',
+                  'autoModeration': 'autoModeration', 'welcomeMessages': 'welcomeMessages'}
+
+def guild_setting(guild_id, key):
+    """Guild override, then the guild 0 default, then the built-in default"""
+    value = guild_settings.get(guild_id, {}).get(key)
+    if value is None:
+        value = guild_settings.get(0, {}).get(key, SETTING_DEFAULTS[key])
+    return value
+
+def setting_enabled(guild_id, key):
+    return guild_setting(guild_id, key) == 'true'
+
+async def load_guild_settings():
+    cursor = await db_conn.execute("SELECT guild_id, key, value FROM guild_settings")
+    guild_settings.clear()
+    for r in await cursor.fetchall():
+        guild_settings.setdefault(r['guild_id'], {})[r['key']] = r['value']
+
+def apply_guild_settings_change(change):
+    values = guild_settings.setdefault(change['guild_id'], {})
+    values.update(change['values'])
+
+cache_handlers['guild_settings'] = apply_guild_settings_change
+
+def settings_payload(guild_id):
+    return {
+        'commandPrefix': guild_setting(guild_id, 'prefix'),
+        **{field: setting_enabled(guild_id, key) for field, key in SETTING_FIELDS.items() if key != 'prefix'}
+    }
+
+async def update_guild_settings(guild_id, data):
+    """Validate and store a settings PATCH; returns an error message or None"""
+    values = {}
+    for field, value in data.items():
+        key = SETTING_FIELDS.get(field)
+        if key is None:
+            continue
+        if key == 'prefix':
+            if not isinstance(value, str) or not value.strip() or len(value) > 10:
+                return 'Prefix must be 1-10 characters'
+            values[key] = value
+        else:
+            values[key] = str(value).lower() if isinstance(value, bool) else value
+    
+    await db_conn.executemany(
+        "INSERT OR REPLACE INTO guild_settings (guild_id, key, value) VALUES (?, ?, ?)",
+        [(guild_id, key, value) for key, value in values.items()]
+    )
+    await db_conn.commit()
+    await publish_cache_change('guild_settings', {'guild_id': guild_id, 'values': values})
+    return None
+
+# The dashboard's bot settings are the defaults shared by every guild
 @routes.get('/api/bots/{id}')
 async def handle_bot_settings_get(request):
-    cursor = await db_conn.execute("SELECT key, value FROM bot_settings")
-    rows = await cursor.fetchall()
-    settings = {r['key']: r['value'] for r in rows}
-    
     return json_response({
         'success': True,
         'bot': {
             'name': bot.user.name if bot.user else 'Nexus Bot',
-            'commandPrefix': settings.get('prefix', 'C7/'),
-            'serverLogs': settings.get('serverLogs', 'true') == 'true',
-            'bigActions': settings.get('bigActions', 'true') == 'true',
-            'autoModeration': settings.get('autoModeration', 'false') == 'true',
-            'welcomeMessages': settings.get('welcomeMessages', 'false') == 'true'
+            **settings_payload(0)
         }
     })
 
 @routes.patch('/api/bots/{id}')
+@admin_only
 async def handle_bot_settings_update(request):
+    error = await update_guild_settings(0, await request.json())
+    if error:
+        return json_response({'error': error}, 400)
+    return json_response({'success': True})
+
+@routes.get('/api/guilds/{id}/settings')
+async def handle_guild_settings_get(request):
+    guild_id = int(request.match_info['id'])
+    return json_response({
+        'success': True,
+        'settings': settings_payload(guild_id),
+        'overrides': sorted(guild_settings.get(guild_id, {}))
+    })
+
+@routes.patch('/api/guilds/{id}/settings')
+@admin_only
+async def handle_guild_settings_update(request):
+    error = await update_guild_settings(int(request.match_info['id']), await request.json())
+    if error:
+        return json_response({'error': error}, 400)
+    return json_response({'success': True})
+
+# --- AUTOMOD ---
+# Rules: 'term' (substring, case-insensitive), 'regex', 'link' (blocked domain, '*' = any link)
+# and 'invite' (Discord invites). Actions: 'delete', or 'warn' = delete and tell the author.
+AUTOMOD_KINDS = ('term', 'regex', 'link', 'invite')
+AUTOMOD_ACTIONS = ('delete', 'warn')
+LINK_RE = re.compile(r"https?://([^/\s:?#]+)", re.IGNORECASE)
+INVITE_RE = re.compile(r"(?:discord(?:app)?\.com/invite|discord\.gg)/[\w-]+", re.IGNORECASE)
+
+automod_rules = {}  # guild id -> list of rule rows
+automod_compiled = {}  # guild id -> CompiledRules, built on first use
+automod_stats = {'scanned': 0, 'matched': 0, 'compiles': 0, 'compile_ms': 0.0}
+automod_scan_times = deque(maxlen=1000)  # recent scan durations in microseconds
+
+class AhoCorasick:
+    """Finds the first of many terms in one pass over the text"""
+    def __init__(self, terms):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [None]  # term ending at this node, directly or through fail links
+        for term in terms:
+            node = 0
+            for ch in term:
+                nxt = self.goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[node][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append(None)
+                node = nxt
+            self.out[node] = self.out[node] or term
+        
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self.goto[node].items():
+                queue.append(nxt)
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                if self.out[nxt] is None:
+                    self.out[nxt] = self.out[self.fail[nxt]]
+    
+    def search(self, text):
+        goto, fail, out = self.goto, self.fail, self.out
+        node = 0
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                return out[node]
+        return None
+
+def regex_combinable(pattern):
+    """Whether the pattern still compiles as one alternative among others"""
+    try:
+        re.compile(f"x|(?:{pattern})")
+        return True
+    except re.error:
+        return False
+
+class CompiledRules:
+    """One guild's rules (plus the global ones) compiled for scanning"""
+    def __init__(self, rules):
+        self.terms = {}  # term -> rule
+        self.regex_rules = {}  # group name -> rule, for rules combined into one pattern
+        self.separate_rules = []  # (compiled pattern, rule) for rules with their own groups or inline flags
+        self.blocked_domains = {}  # domain -> rule
+        self.invite_rule = None
+        for rule in rules:
+            if rule['kind'] == 'term':
+                self.terms.setdefault(rule['pattern'].casefold(), rule)
+            elif rule['kind'] == 'regex':
+                try:
+                    compiled = re.compile(rule['pattern'], re.IGNORECASE)
+                except re.error as e:
+                    print(f"[MOD] X Skipping automod rule {rule['id']}: {e}")
+                    continue
+                # Group names and numbered backreferences would clash once rules are joined, and
+                # inline global flags such as (?i) are only allowed at the start of a whole pattern
+                if compiled.groups or not regex_combinable(rule['pattern']):
+                    self.separate_rules.append((compiled, rule))
+                else:
+                    self.regex_rules[f"r{rule['id']}"] = rule
+            elif rule['kind'] == 'link':
+                self.blocked_domains.setdefault(rule['pattern'].lower(), rule)
+            elif rule['kind'] == 'invite':
+                self.invite_rule = self.invite_rule or rule
+        self.automaton = AhoCorasick(self.terms) if self.terms else None
+        self.regex = None
+        if self.regex_rules:
+            try:
+                self.regex = re.compile(
+                    '|'.join(f"(?P<{name}>{rule['pattern']})" for name, rule in self.regex_rules.items()),
+                    re.IGNORECASE
+                )
+            except re.error:
+                # Not expected after the checks above; fall back to checking them one by one
+                self.separate_rules += [(re.compile(rule['pattern'], re.IGNORECASE), rule) for rule in self.regex_rules.values()]
+                self.regex_rules = {}
+    
+    def check(self, content):
+        """The first rule the message breaks, or None"""
+        if self.automaton:
+            term = self.automaton.search(content.casefold())
+            if term:
+                return self.terms[term]
+        if self.regex:
+            match = self.regex.search(content)
+            if match:
+                return self.regex_rules[match.lastgroup]
+        for compiled, rule in self.separate_rules:
+            if compiled.search(content):
+                return rule
+        if self.invite_rule and INVITE_RE.search(content):
+            return self.invite_rule
+        if self.blocked_domains:
+            for host in LINK_RE.findall(content):
+                rule = self.blocked_domains.get('*') or self.domain_rule(host.lower())
+                if rule:
+                    return rule
+        return None
+    
+    def domain_rule(self, host):
+        # example.com also blocks cdn.example.com
+        labels = host.split('.')
+        for i in range(len(labels) - 1):
+            rule = self.blocked_domains.get('.'.join(labels[i:]))
+            if rule:
+                return rule
+        return None
+
+def automod_for(guild_id):
+    compiled = automod_compiled.get(guild_id)
+    if compiled is None:
+        start = time.perf_counter()
+        compiled = automod_compiled[guild_id] = CompiledRules(automod_rules.get(0, []) + automod_rules.get(guild_id, []))
+        automod_stats['compiles'] += 1
+        automod_stats['compile_ms'] += (time.perf_counter() - start) * 1000
+    return compiled
+
+def automod_check(guild_id, content):
+    start = time.perf_counter_ns()
+    rule = automod_for(guild_id).check(content)
+    automod_scan_times.append((time.perf_counter_ns() - start) / 1000)
+    automod_stats['scanned'] += 1
+    if rule:
+        automod_stats['matched'] += 1
+    return rule
+
+async def load_automod_rules():
+    cursor = await db_conn.execute("SELECT id, guild_id, kind, pattern, action FROM automod_rules")
+    automod_rules.clear()
+    automod_compiled.clear()
+    for r in await cursor.fetchall():
+        automod_rules.setdefault(r['guild_id'], []).append(dict(r))
+
+def apply_automod_change(change):
+    guild_id = change['guild_id']
+    if change['op'] == 'add':
+        automod_rules.setdefault(guild_id, []).append(change['rule'])
+    elif change['op'] == 'remove':
+        automod_rules[guild_id] = [r for r in automod_rules.get(guild_id, []) if r['id'] != change['id']]
+    # Global rules feed every guild's compiled set
+    if guild_id == 0:
+        automod_compiled.clear()
+    else:
+        automod_compiled.pop(guild_id, None)
+
+cache_handlers['automod'] = apply_automod_change
+memory_reporters['automod'] = lambda: {
+    'rules': sum(len(rules) for rules in automod_rules.values()),
+    'compiled_guilds': len(automod_compiled),
+    'automaton_nodes': sum(len(c.automaton.goto) for c in automod_compiled.values() if c.automaton)
+}
+
+def validate_automod_rule(kind, pattern, action):
+    if kind not in AUTOMOD_KINDS:
+        return f"kind must be one of {', '.join(AUTOMOD_KINDS)}"
+    if action not in AUTOMOD_ACTIONS:
+        return f"action must be one of {', '.join(AUTOMOD_ACTIONS)}"
+    if kind != 'invite' and not pattern:
+        return 'pattern required'
+    if kind == 'regex':
+        try:
+            re.compile(pattern)
+        except re.error as e:
+            return f"Invalid regex: {e}"
+    return None
+
+@routes.get('/api/guilds/{id}/automod')
+async def handle_automod_get(request):
+    guild_id = int(request.match_info['id'])
+    return json_response({'success': True, 'rules': automod_rules.get(guild_id, [])})
+
+@routes.post('/api/guilds/{id}/automod')
+@admin_only
+async def handle_automod_add(request):
+    guild_id = int(request.match_info['id'])
     data = await request.json()
+    kind = data.get('kind')
+    pattern = (data.get('pattern') or '').strip()
+    action = data.get('action', 'delete')
     
-    for key, value in data.items():
-        if key in ['commandPrefix', 'serverLogs', 'bigActions', 'autoModeration', 'welcomeMessages']:
-            db_key = key if key != 'commandPrefix' else 'prefix'
-            await db_conn.execute(
-                "INSERT OR REPLACE INTO bot_settings (key, value) VALUES (?, ?)",
-                (db_key, str(value).lower() if isinstance(value, bool) else value)
-            )
+    error = validate_automod_rule(kind, pattern, action)
+    if error:
+        return json_response({'error': error}, 400)
     
+    cursor = await db_conn.execute(
+        "INSERT INTO automod_rules (guild_id, kind, pattern, action) VALUES (?, ?, ?, ?)",
+        (guild_id, kind, pattern, action)
+    )
     await db_conn.commit()
+    rule = {'id': cursor.lastrowid, 'guild_id': guild_id, 'kind': kind, 'pattern': pattern, 'action': action}
+    await publish_cache_change('automod', {'op': 'add', 'guild_id': guild_id, 'rule': rule})
+    return json_response({'success': True, 'rule': rule})
+
+@routes.delete('/api/guilds/{guild_id}/automod/{id}')
+@admin_only
+async def handle_automod_delete(request):
+    guild_id = int(request.match_info['guild_id'])
+    rule_id = int(request.match_info['id'])
+    await db_conn.execute("DELETE FROM automod_rules WHERE id = ? AND guild_id = ?", (rule_id, guild_id))
+    await db_conn.commit()
+    await publish_cache_change('automod', {'op': 'remove', 'guild_id': guild_id, 'id': rule_id})
     return json_response({'success': True})
 
+async def automod_report():
+    times = sorted(automod_scan_times)
+    def percentile(p):
+        return round(times[min(len(times) - 1, int(len(times) * p))], 1) if times else 0
+    return {
+        **automod_stats,
+        'compile_ms': round(automod_stats['compile_ms'], 2),
+        'rules': sum(len(rules) for rules in automod_rules.values()),
+        'compiled_guilds': len(automod_compiled),
+        'scan_us': {'p50': percentile(0.5), 'p99': percentile(0.99), 'max': round(times[-1], 1) if times else 0,
+                    'samples': len(times)}
+    }
+
+bot_commands['automod_report'] = automod_report
+
+@routes.get('/api/debug/automod')
+@admin_only
+async def handle_debug_automod(request):
+    # Messages are scanned in the bot process
+    try:
+        report = await automod_report() if bot_in_process else await bot_rpc('automod_report', timeout=5)
+    except (asyncio.TimeoutError, BotCommandError) as e:
+        return json_response({'error': str(e) or 'Bot process did not answer'}, 504)
+    return json_response({'success': True, **report})
+
+# --- FLOOD DETECTION ---
+
+class RateCounter:
+    """Events per key over a sliding window of one-second buckets, one byte per bucket"""
+    def __init__(self, window):
+        self.window = window
+        # key -> 4-byte last hit second + one counter byte per second; least recently hit first
+        self.keys = OrderedDict()
+    
+    def hit(self, key, now=None):
+        """Count one event and return the key's total over the window"""
+        now = int(time.monotonic()) if now is None else now
+        buckets = self.keys.get(key)
+        if buckets is None:
+            buckets = self.keys[key] = bytearray(4 + self.window)
+        else:
+            self._expire(buckets, now)
+            self.keys.move_to_end(key)
+        struct.pack_into('<I', buckets, 0, now)
+        slot = 4 + now % self.window
+        if buckets[slot] < 255:
+            buckets[slot] += 1
+        self._evict(now)
+        return sum(memoryview(buckets)[4:])
+    
+    def _expire(self, buckets, now):
+        last, = struct.unpack_from('<I', buckets, 0)
+        if now - last >= self.window:
+            buckets[4:] = bytes(self.window)
+            return
+        for second in range(last + 1, now + 1):
+            buckets[4 + second % self.window] = 0
+    
+    def _evict(self, now):
+        # Keys are ordered by last hit, so idle ones are at the front
+        while self.keys:
+            key, buckets = next(iter(self.keys.items()))
+            if now - struct.unpack_from('<I', buckets, 0)[0] < self.window:
+                break
+            del self.keys[key]
+
+def member_key(guild_id, user_id):
+    """(guild, user) packed into one int; smaller than a tuple key at this many users"""
+    return guild_id << 64 | user_id
+
+user_messages = RateCounter(SPAM_WINDOW)  # member_key -> messages
+channel_messages = RateCounter(SPAM_WINDOW)  # channel id -> messages
+guild_messages = RateCounter(SPAM_WINDOW)  # guild id -> messages
+guild_joins = RateCounter(RAID_WINDOW)  # guild id -> joins
+slowed_channels = set()
+slowed_guilds = set()  # guilds whose active channels were just slowed as a whole
+raid_lockdowns = set()  # guilds with raised verification
+
+memory_reporters['flood'] = lambda: {
+    'tracked_users': len(user_messages.keys),
+    'tracked_channels': len(channel_messages.keys),
+    'tracked_guilds': len(guild_joins.keys),
+    'counter_bytes': (4 + SPAM_WINDOW) * (len(user_messages.keys) + len(channel_messages.keys) + len(guild_messages.keys))
+                     + (4 + RAID_WINDOW) * len(guild_joins.keys)
+}
+
+# --- PACING ---
+class Pacer:
+    """Spaces calls evenly at rate per second; share one instance to share the budget"""
+    def __init__(self, rate):
+        self.rate = rate
+        self.next_slot = 0.0
+    
+    async def wait(self):
+        now = time.monotonic()
+        slot = max(now, self.next_slot)
+        self.next_slot = slot + 1 / self.rate
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+class Throttle:
+    """Lets an action through at most once per interval seconds, unless forced"""
+    def __init__(self, interval):
+        self.interval = interval
+        self.last = 0.0
+    
+    def ready(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.last < self.interval:
+            return False
+        self.last = now
+        return True
+
+# --- OUTBOUND ---
+# Every Discord send goes through one scheduler, so command replies never wait behind log relays
+OUTBOUND_CLASSES = ('interactive', 'notice', 'bulk')  # highest priority first
+
+class OutboundQueueFull(Exception):
+    pass
+
+class OutboundScheduler:
+    """Per-channel priority queues drained by a worker pool. Workers always take the channel
+    whose next message has the highest priority, among channels whose bucket allows a send"""
+    def __init__(self, workers, rate, channel_burst, channel_window, max_bulk):
+        self.workers = workers
+        self.rate = rate
+        self.channel_burst = channel_burst
+        self.channel_window = channel_window
+        self.max_bulk = max_bulk
+        self.queues = {}  # channel id -> heap of (priority, seq, enqueued_at, future, send, args, kwargs)
+        self.sent_at = {}  # channel id -> deque of recent send times
+        self.busy = set()  # channels with a send in flight; one at a time keeps their order
+        self.timers = {}  # channel id -> handle that re-queues it when its bucket refills
+        self.ready = []  # heap of (priority, seq, channel id); stale entries are skipped
+        self.wakeup = asyncio.Event()
+        self.seq = 0
+        self.pacer = Pacer(rate)
+        self.tasks = []
+        self.waits = {name: deque(maxlen=1000) for name in OUTBOUND_CLASSES}
+        self.stats = {name: {'sent': 0, 'failed': 0, 'dropped': 0} for name in OUTBOUND_CLASSES}
+    
+    def submit(self, channel_id, name, send, *args, **kwargs):
+        """Queue send(*args, **kwargs) for a channel; returns a future for its result"""
+        future = asyncio.get_running_loop().create_future()
+        queue = self.queues.setdefault(channel_id, [])
+        if name == 'bulk' and len(queue) >= self.max_bulk:
+            self.stats[name]['dropped'] += 1
+            future.set_exception(OutboundQueueFull(f"{len(queue)} bulk messages already queued for this channel"))
+            return future
+        if not self.tasks:
+            self.tasks = [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+        if len(self.sent_at) > 10000:
+            self.forget_idle_channels()
+        self.seq += 1
+        heapq.heappush(queue, (OUTBOUND_CLASSES.index(name), self.seq, time.monotonic(), future, send, args, kwargs))
+        if queue[0][1] == self.seq:
+            self.schedule(channel_id)
+        return future
+    
+    async def send(self, channel_id, name, send, *args, **kwargs):
+        return await self.submit(channel_id, name, send, *args, **kwargs)
+    
+    def post(self, channel_id, name, send, *args, **kwargs):
+        """Fire and forget; failures other than missing access are printed"""
+        self.submit(channel_id, name, send, *args, **kwargs).add_done_callback(self._report_failure)
+    
+    @staticmethod
+    def _report_failure(future):
+        if future.cancelled() or isinstance(future.exception(), (type(None), OutboundQueueFull, discord.Forbidden, discord.NotFound)):
+            return
+        print(f"[OUT] X Send failed: {future.exception()}")
+    
+    def bucket_delay(self, channel_id):
+        """Seconds until the channel may send again"""
+        sent = self.sent_at.get(channel_id)
+        if not sent:
+            return 0
+        now = time.monotonic()
+        while sent and sent[0] <= now - self.channel_window:
+            sent.popleft()
+        return sent[0] + self.channel_window - now if len(sent) >= self.channel_burst else 0
+    
+    def schedule(self, channel_id):
+        """Offer the channel's next message to the workers, now or when its bucket refills"""
+        queue = self.queues.get(channel_id)
+        if not queue or channel_id in self.busy or channel_id in self.timers:
+            return
+        delay = self.bucket_delay(channel_id)
+        if delay > 0:
+            self.timers[channel_id] = asyncio.get_running_loop().call_later(delay, self._refilled, channel_id)
+            return
+        priority, seq = queue[0][:2]
+        heapq.heappush(self.ready, (priority, seq, channel_id))
+        self.wakeup.set()
+    
+    def _refilled(self, channel_id):
+        self.timers.pop(channel_id, None)
+        self.schedule(channel_id)
+    
+    def forget_idle_channels(self):
+        cutoff = time.monotonic() - self.channel_window
+        for channel_id in [c for c, sent in self.sent_at.items() if not sent or sent[-1] <= cutoff]:
+            del self.sent_at[channel_id]
+    
+    def take(self):
+        """Next job from the best ready channel, or None"""
+        while self.ready:
+            priority, seq, channel_id = heapq.heappop(self.ready)
+            queue = self.queues.get(channel_id)
+            if channel_id in self.busy or not queue or queue[0][1] != seq:
+                continue
+            self.busy.add(channel_id)
+            return channel_id, heapq.heappop(queue)
+        return None
+    
+    async def worker(self):
+        while True:
+            if not self.ready:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            taken = self.take()
+            if taken is None:
+                continue
+            channel_id, (priority, _, enqueued_at, future, send, args, kwargs) = taken
+            name = OUTBOUND_CLASSES[priority]
+            try:
+                if future.cancelled():
+                    continue
+                await self.pacer.wait()
+                self.waits[name].append((time.monotonic() - enqueued_at) * 1000)
+                self.sent_at.setdefault(channel_id, deque()).append(time.monotonic())
+                try:
+                    result = await send(*args, **kwargs)
+                except Exception as e:
+                    self.stats[name]['failed'] += 1
+                    if not future.done():
+                        future.set_exception(e)
+                else:
+                    self.stats[name]['sent'] += 1
+                    if not future.done():
+                        future.set_result(result)
+            finally:
+                self.busy.discard(channel_id)
+                if self.queues.get(channel_id):
+                    self.schedule(channel_id)
+                else:
+                    self.queues.pop(channel_id, None)
+    
+    def report(self):
+        queued = {name: 0 for name in OUTBOUND_CLASSES}
+        for queue in self.queues.values():
+            for entry in queue:
+                queued[OUTBOUND_CLASSES[entry[0]]] += 1
+        classes = {}
+        for name in OUTBOUND_CLASSES:
+            waits = sorted(self.waits[name])
+            def percentile(p):
+                return round(waits[min(len(waits) - 1, int(len(waits) * p))], 1) if waits else 0
+            classes[name] = {
+                **self.stats[name],
+                'queued': queued[name],
+                'wait_ms': {'p50': percentile(0.5), 'p99': percentile(0.99), 'max': round(waits[-1], 1) if waits else 0,
+                            'samples': len(waits)}
+            }
+        return {'classes': classes, 'channels': len(self.queues), 'waitingForBucket': len(self.timers)}
+
+outbound = OutboundScheduler(OUTBOUND_WORKERS, OUTBOUND_RATE, OUTBOUND_CHANNEL_BURST, OUTBOUND_CHANNEL_WINDOW, OUTBOUND_MAX_BULK)
+memory_reporters['outbound'] = lambda: {
+    'channels': len(outbound.queues),
+    'queued': sum(len(q) for q in outbound.queues.values()),
+    'buckets': len(outbound.sent_at)
+}
+
+class OutboundContext(commands.Context):
+    """Command replies go through the outbound scheduler ahead of everything else"""
+    async def send(self, *args, **kwargs):
+        return await outbound.send(self.channel.id, 'interactive', super().send, *args, **kwargs)
+
+async def outbound_report():
+    return outbound.report()
+
+bot_commands['outbound_report'] = outbound_report
+
+@routes.get('/api/debug/outbound')
+@admin_only
+async def handle_debug_outbound(request):
+    # Sends are queued in the bot process
+    try:
+        report = await outbound_report() if bot_in_process else await bot_rpc('outbound_report', timeout=5)
+    except (asyncio.TimeoutError, BotCommandError) as e:
+        return json_response({'error': str(e) or 'Bot process did not answer'}, 504)
+    return json_response({'success': True, **report})
+
 # --- WEBSOCKET ---
-async def broadcast(event_type, data):
-    """Send event to all connected WebSocket clients"""
-    if not connected_websockets:
-        return
+ws_stats = {
+    'accepted': 0, 'closed': 0, 'rejected_global': 0, 'rejected_ip': 0, 'idle_reaped': 0,
+    'overflow_disconnects': 0, 'send_errors': 0, 'resumes': 0, 'resyncs': 0
+}
+ws_ip_counts = {}  # remote address -> open sockets
+
+# Topics: memes, votes (all memes), meme:<id>, logs (all servers), logs:<folder id>, stats
+WS_TOPICS = {'memes', 'votes', 'logs', 'stats'}
+WS_TOPIC_PREFIXES = ('meme:', 'logs:')
+# Clients that never subscribe get what the dashboard has always received
+WS_DEFAULT_TOPICS = ('memes', 'votes')
+
+# Wire encodings a client can pick with /ws?encoding=...
+WS_ENCODINGS = ('json', 'msgpack')
+
+def encode_payload(obj, encoding):
+    """Text frame for json, binary frame for msgpack"""
+    if encoding == 'msgpack':
+        return msgpack.packb(obj, default=str)
+    return json.dumps(obj, default=str)
+
+# Every broadcast is numbered; a restarted server starts a new stream. With several
+# processes the hub numbers them, so a client can resume on any web worker
+WS_STREAM_ID = uuid.uuid4().hex[:12]
+ws_seq = 0
+ws_replay = deque(maxlen=WS_REPLAY_SIZE)
+
+class Frame:
+    """A sequenced broadcast event, serialized at most once per encoding"""
+    __slots__ = ('seq', 'event', 'data', 'topics', 'exclude', '_encoded')
+    
+    def __init__(self, seq, event, data, topics, exclude):
+        self.seq = seq
+        self.event = event
+        self.data = data
+        self.topics = tuple(topics)
+        self.exclude = tuple(exclude)
+        self._encoded = {}
     
-    message = json.dumps({'event': event_type, 'data': data})
-    dead_sockets = set()
+    def encoded(self, encoding):
+        payload = self._encoded.get(encoding)
+        if payload is None:
+            payload = encode_payload({'event': self.event, 'seq': self.seq, 'data': self.data}, encoding)
+            self._encoded[encoding] = payload
+        return payload
+    
+    def wanted_by(self, client):
+        return not client.topics.isdisjoint(self.topics) and client.topics.isdisjoint(self.exclude)
+
+def valid_topic(topic):
+    if topic in WS_TOPICS:
+        return True
+    prefix, _, suffix = topic.partition(':')
+    return f"{prefix}:" in WS_TOPIC_PREFIXES and suffix.isdigit()
+
+class WSClient:
+    """Dashboard socket with its own bounded outbound queue and writer task"""
+    def __init__(self, ws, remote, encoding='json'):
+        self.ws = ws
+        self.remote = remote
+        self.encoding = encoding
+        self.queue = asyncio.Queue(maxsize=WS_QUEUE_SIZE)
+        self.connected_at = time.monotonic()
+        self.last_seen = self.connected_at
+        self.sent = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.closing = False
+        self.topics = set()
+        self.writer = asyncio.create_task(self._drain())
+    
+    def subscribe(self, topics):
+        for topic in topics:
+            if len(self.topics) >= WS_MAX_TOPICS:
+                break
+            if isinstance(topic, str) and valid_topic(topic):
+                self.topics.add(topic)
+                topic_subscribers.setdefault(topic, set()).add(self)
     
-    for ws in connected_websockets:
+    def unsubscribe(self, topics):
+        for topic in topics:
+            if topic not in self.topics:
+                continue
+            self.topics.discard(topic)
+            subscribers = topic_subscribers.get(topic)
+            if subscribers is not None:
+                subscribers.discard(self)
+                if not subscribers:
+                    del topic_subscribers[topic]
+    
+    def enqueue(self, message):
+        """Queue a frame without waiting; False if the client is too far behind"""
+        if self.closing:
+            return True
         try:
-            await ws.send_str(message)
-        except:
-            dead_sockets.add(ws)
+            self.queue.put_nowait((time.monotonic(), message))
+            return True
+        except asyncio.QueueFull:
+            return False
+    
+    async def _drain(self):
+        while True:
+            queued_at, message = await self.queue.get()
+            try:
+                if isinstance(message, bytes):
+                    await self.ws.send_bytes(message)
+                else:
+                    await self.ws.send_str(message)
+            except Exception:
+                ws_stats['send_errors'] += 1
+                self.disconnect()
+                return
+            lag = time.monotonic() - queued_at
+            self.sent += 1
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+    
+    def send_event(self, event_type, data):
+        """Queue an unsequenced message meant only for this client"""
+        return self.enqueue(encode_payload({'event': event_type, 'data': data}, self.encoding))
+    
+    def disconnect(self, code=aiohttp.WSCloseCode.GOING_AWAY, message=b''):
+        """Stop writing to this client and close its socket in the background"""
+        if self.closing:
+            return
+        self.closing = True
+        self.writer.cancel()
+        self.unsubscribe(list(self.topics))
+        connected_websockets.pop(self.ws, None)
+        asyncio.create_task(self.ws.close(code=code, message=message))
+    
+    def metrics(self):
+        return {
+            'remote': self.remote,
+            'connected_for': round(time.monotonic() - self.connected_at, 1),
+            'idle_for': round(time.monotonic() - self.last_seen, 1),
+            'queued': self.queue.qsize(),
+            'sent': self.sent,
+            'topics': sorted(self.topics),
+            'encoding': self.encoding,
+            'compress': bool(self.ws.compress),
+            'last_lag_ms': round(self.last_lag * 1000, 2),
+            'max_lag_ms': round(self.max_lag * 1000, 2)
+        }
+
+async def broadcast(event_type, data, topics, exclude=()):
+    """Send an event to subscribed WebSocket clients of every web worker"""
+    await event_bus.publish('ws', {'event': event_type, 'data': data, 'topics': list(topics), 'exclude': list(exclude)})
+
+def set_ws_stream(message):
+    """Adopt the hub's stream id and sequence when connecting to it"""
+    global WS_STREAM_ID, ws_seq
+    if message['stream'] != WS_STREAM_ID:
+        WS_STREAM_ID = message['stream']
+        ws_replay.clear()
+    ws_seq = max(ws_seq, message['seq']) if ws_replay else message['seq']
+
+def deliver_broadcast(message):
+    """Sequence an event and queue it for this worker's clients (never waits on a socket)"""
+    global ws_seq
+    ws_seq = message.get('seq', ws_seq + 1)
+    frame = Frame(ws_seq, message['event'], message['data'], message['topics'], message['exclude'])
+    ws_replay.append(frame)
+    
+    recipients = set()
+    for topic in frame.topics:
+        recipients.update(topic_subscribers.get(topic, ()))
+    for topic in frame.exclude:
+        recipients.difference_update(topic_subscribers.get(topic, ()))
+    for client in recipients:
+        send_to_client(client, frame.encoded(client.encoding))
+
+def send_to_client(client, message):
+    if not client.enqueue(message):
+        # Slow consumer: drop it instead of holding everyone else back
+        ws_stats['overflow_disconnects'] += 1
+        print(f"[WS] X Queue overflow, disconnecting {client.remote}")
+        client.disconnect(aiohttp.WSCloseCode.TRY_AGAIN_LATER, b'Outbound queue overflow')
+
+def resume_client(client, last_seq, stream):
+    """Replay events the client missed, or tell it to resync from the REST API"""
+    oldest = ws_replay[0].seq if ws_replay else ws_seq + 1
+    missed = None
+    if stream == WS_STREAM_ID and oldest - 1 <= last_seq <= ws_seq:
+        missed = [f for f in ws_replay if f.seq > last_seq and f.wanted_by(client)]
+    
+    if missed is None or len(missed) >= WS_QUEUE_SIZE:
+        ws_stats['resyncs'] += 1
+        client.send_event('resync_required', {'stream': WS_STREAM_ID, 'seq': ws_seq})
+        return
+    
+    ws_stats['resumes'] += 1
+    for frame in missed:
+        send_to_client(client, frame.encoded(client.encoding))
+    client.send_event('resumed', {'seq': ws_seq, 'replayed': len(missed)})
+
+class VoteCoalescer:
+    """Collects the latest vote counts per meme and sends them as one message per window"""
+    def __init__(self, window_ms):
+        self.window = window_ms / 1000
+        self.pending = {}  # meme id -> (like_count, dislike_count)
+        self.flush_task = None
+    
+    def add(self, meme_id, like_count, dislike_count):
+        self.pending[meme_id] = (like_count, dislike_count)
+        if self.flush_task is None and self.window:
+            self.flush_task = asyncio.create_task(self._flush_later())
+    
+    async def _flush_later(self):
+        await asyncio.sleep(self.window)
+        self.flush_task = None
+        await self.flush()
     
-    connected_websockets.difference_update(dead_sockets)
+    async def flush(self):
+        pending, self.pending = self.pending, {}
+        if not pending:
+            return
+        votes = [{'memeId': m, 'likeCount': likes, 'dislikeCount': dislikes}
+                 for m, (likes, dislikes) in pending.items()]
+        await broadcast('vote_batch', {'votes': votes}, ['votes'])
+        if MEME_WEIGHTING == 'likes':
+            await publish_cache_change('meme_pool', {'op': 'likes', 'counts': [
+                [m, likes] for m, (likes, _) in pending.items()
+            ]})
+        
+        # Single-meme watchers that aren't already getting the batch
+        for vote in votes:
+            await broadcast('vote_update', vote, [f"meme:{vote['memeId']}"], exclude=['votes'])
+
+vote_coalescer = VoteCoalescer(VOTE_COALESCE_MS)
+
+async def handle_ws_message(client, data):
+    """Client -> server protocol:
+    {"action": "subscribe" | "unsubscribe", "topics": [...]}
+    {"action": "ping"}
+    Resuming happens at connect time (/ws?stream=...&seq=...), before any live event
+    """
+    action = data.get('action')
+    if action == 'ping':
+        client.send_event('pong', {'seq': ws_seq})
+        return
+    
+    topics = data.get('topics') or []
+    if not isinstance(topics, list):
+        topics = [topics]
+    
+    if action == 'subscribe':
+        client.subscribe(topics)
+    elif action == 'unsubscribe':
+        client.unsubscribe(topics)
+    else:
+        return
+    client.send_event('subscribed', {'topics': sorted(client.topics)})
 
 @routes.get('/ws')
 async def websocket_handler(request):
-    ws = web.WebSocketResponse()
+    # Opt-in framing: /ws?encoding=msgpack&compress=1 (permessage-deflate)
+    encoding = request.query.get('encoding', 'json')
+    if encoding not in WS_ENCODINGS:
+        return json_response({'error': f'Unsupported encoding, use one of {list(WS_ENCODINGS)}'}, 400)
+    compress = request.query.get('compress', '0') in ('1', 'true')
+    # Reconnects resume here: /ws?stream=<stream from hello>&seq=<last seq seen>[&topics=memes,logs:3]
+    resume_stream = request.query.get('stream')
+    resume_seq = request.query.get('seq', '')
+    if resume_stream and not resume_seq.isdigit():
+        return json_response({'error': 'seq must be a number when resuming a stream'}, 400)
+    topics = [t for t in request.query.get('topics', '').split(',') if t] or WS_DEFAULT_TOPICS
+    
+    # Admission limits
+    remote = client_address(request)
+    if WS_MAX_CONNECTIONS and len(connected_websockets) >= WS_MAX_CONNECTIONS:
+        ws_stats['rejected_global'] += 1
+        return json_response({'error': 'Too many connections'}, 503)
+    if WS_MAX_PER_IP and ws_ip_counts.get(remote, 0) >= WS_MAX_PER_IP:
+        ws_stats['rejected_ip'] += 1
+        return json_response({'error': 'Too many connections from this address'}, 429)
+    
+    ws = web.WebSocketResponse(compress=compress, heartbeat=WS_HEARTBEAT or None)
     await ws.prepare(request)
     
-    connected_websockets.add(ws)
+    # No await from here to the receive loop, so the replay is queued before any live frame
+    client = WSClient(ws, remote, encoding)
+    client.subscribe(topics)
+    connected_websockets[ws] = client
+    ws_ip_counts[remote] = ws_ip_counts.get(remote, 0) + 1
+    client.send_event('hello', {'stream': WS_STREAM_ID, 'seq': ws_seq, 'encoding': encoding})
+    if resume_stream:
+        resume_client(client, int(resume_seq), resume_stream)
+    ws_stats['accepted'] += 1
     print(f"[WS] Client connected. Total: {len(connected_websockets)}")
     
     try:
         async for msg in ws:
+            client.last_seen = time.monotonic()
             if msg.type == aiohttp.WSMsgType.TEXT:
                 try:
                     data = json.loads(msg.data)
-                    # Handle incoming messages if needed
-                except:
-                    pass
+                except ValueError:
+                    continue
+                if isinstance(data, dict):
+                    await handle_ws_message(client, data)
             elif msg.type == aiohttp.WSMsgType.ERROR:
                 break
     finally:
-        connected_websockets.discard(ws)
+        client.closing = True
+        client.writer.cancel()
+        client.unsubscribe(list(client.topics))
+        connected_websockets.pop(ws, None)
+        ws_ip_counts[remote] -= 1
+        if not ws_ip_counts[remote]:
+            del ws_ip_counts[remote]
+        ws_stats['closed'] += 1
         print(f"[WS] Client disconnected. Total: {len(connected_websockets)}")
     
     return ws
 
+def client_address(request):
+    """Address for the per-IP cap; behind a proxy, the last hop it appended to WS_CLIENT_IP_HEADER"""
+    if WS_CLIENT_IP_HEADER:
+        forwarded = request.headers.get(WS_CLIENT_IP_HEADER, '').rpartition(',')[2].strip()
+        if forwarded:
+            return forwarded
+    return request.remote
+
+async def reap_idle_websockets():
+    """Close sockets that haven't sent anything (not even a ping) for WS_IDLE_TIMEOUT.
+    Heartbeat pongs never reach the handler, so with heartbeats on they alone decide liveness"""
+    if not WS_IDLE_TIMEOUT or WS_HEARTBEAT:
+        return
+    while True:
+        await asyncio.sleep(min(30, WS_IDLE_TIMEOUT / 2))
+        cutoff = time.monotonic() - WS_IDLE_TIMEOUT
+        for client in list(connected_websockets.values()):
+            if client.last_seen < cutoff:
+                ws_stats['idle_reaped'] += 1
+                client.disconnect(aiohttp.WSCloseCode.GOING_AWAY, b'Idle timeout')
+
+@routes.get('/api/debug/ws')
+@admin_only
+async def handle_debug_ws(request):
+    clients = [c.metrics() for c in connected_websockets.values()]
+    return json_response({
+        'success': True,
+        'worker': WORKER_ID,
+        'connections': len(clients),
+        'addresses': len(ws_ip_counts),
+        'limits': {'max_connections': WS_MAX_CONNECTIONS, 'max_per_ip': WS_MAX_PER_IP,
+                   'heartbeat': WS_HEARTBEAT, 'idle_timeout': WS_IDLE_TIMEOUT},
+        'queued_total': sum(c['queued'] for c in clients),
+        'max_lag_ms': max((c['max_lag_ms'] for c in clients), default=0),
+        'topics': {t: len(subs) for t, subs in topic_subscribers.items()},
+        'stream': WS_STREAM_ID,
+        'seq': ws_seq,
+        'replay_buffered': len(ws_replay),
+        **ws_stats,
+        'clients': clients
+    })
+
+memory_reporters['websockets'] = lambda: {
+    'connections': len(connected_websockets),
+    'topics': len(topic_subscribers),
+    'queued_frames': sum(c.queue.qsize() for c in connected_websockets.values()),
+    'replay_buffered': len(ws_replay)
+}
+
+@routes.get('/api/debug/memory')
+@admin_only
+async def handle_debug_memory(request):
+    report = memory_report()
+    if not bot_in_process:
+        # The Discord caches live in the bot process
+        try:
+            report.update(await bot_rpc('memory_report', timeout=5))
+        except (asyncio.TimeoutError, BotCommandError) as e:
+            report['discord'] = {'error': str(e) or 'Bot process did not answer'}
+    return json_response({'success': True, 'worker': WORKER_ID, **report})
+
 # --- STATIC FILES ---
 @routes.get('/')
 async def handle_root(request):
@@ -806,29 +3173,147 @@ async def serve_static(request):
 
 # --- DISCORD BOT EVENTS ---
 
+# --- PENDING SAVES ---
+
+class TTLStore:
+    """Bounded key -> value store whose entries expire, optionally mirrored to a table"""
+    def __init__(self, ttl, max_size, table=None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.table = table
+        self.entries = OrderedDict()  # key -> (expires at, value), oldest first
+        self.expired = 0
+        self.evicted = 0
+    
+    def __len__(self):
+        return len(self.entries)
+    
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < time.time():
+            return None
+        return entry[1]
+    
+    async def set(self, key, value):
+        expires_at = time.time() + self.ttl
+        self.entries.pop(key, None)
+        self.entries[key] = (expires_at, value)
+        while len(self.entries) > self.max_size:
+            old_key, _ = self.entries.popitem(last=False)
+            self.evicted += 1
+            await self._delete(old_key)
+        if self.table:
+            await db_conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, data, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), expires_at)
+            )
+            await db_conn.commit()
+    
+    async def pop(self, key):
+        """Remove and return a live entry; None if missing or expired"""
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return None
+        await self._delete(key)
+        return entry[1] if entry[0] >= time.time() else None
+    
+    async def _delete(self, key):
+        if self.table:
+            await db_conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            await db_conn.commit()
+    
+    async def load(self):
+        """Restore unexpired entries saved by a previous run"""
+        if not self.table:
+            return
+        cursor = await db_conn.execute(
+            f"SELECT key, data, expires_at FROM {self.table} WHERE expires_at >= ? ORDER BY expires_at",
+            (time.time(),)
+        )
+        for row in await cursor.fetchall():
+            self.entries[row['key']] = (row['expires_at'], json.loads(row['data']))
+    
+    async def sweep(self):
+        # Entries share one TTL, so the oldest are always at the front
+        now = time.time()
+        while self.entries:
+            key, (expires_at, _) = next(iter(self.entries.items()))
+            if expires_at >= now:
+                break
+            del self.entries[key]
+            self.expired += 1
+        if self.table:
+            await db_conn.execute(f"DELETE FROM {self.table} WHERE expires_at < ?", (now,))
+            await db_conn.commit()
+    
+    async def run_sweeper(self):
+        while True:
+            await asyncio.sleep(min(60, self.ttl))
+            await self.sweep()
+
+waiting_users = TTLStore(PENDING_SAVE_TTL, PENDING_SAVE_MAX, 'pending_saves' if PENDING_SAVE_PERSIST else None)
+memory_reporters['pending_saves'] = lambda: {
+    'pending': len(waiting_users),
+    'max': waiting_users.max_size,
+    'expired': waiting_users.expired,
+    'evicted': waiting_users.evicted
+}
+
+recent_messages = OrderedDict()  # message id -> what a Save needs, newest last
+memory_reporters['recent_messages'] = lambda: {'messages': len(recent_messages), 'max': RECENT_MESSAGE_CACHE}
+
+def remember_message(message):
+    recent_messages[message.id] = {
+        'username': str(message.author),
+        'content': message.content,
+        'guild_id': message.guild.id if message.guild else 0
+    }
+    while len(recent_messages) > RECENT_MESSAGE_CACHE:
+        recent_messages.popitem(last=False)
+
+async def find_saved_source(channel_id, message_id, log_id):
+    """Content of a logged message: recent cache, then message_logs, then the Discord API"""
+    cached = recent_messages.get(message_id)
+    if cached:
+        return cached
+    if log_id:
+        cursor = await db_conn.execute(
+            "SELECT username, content, server_id FROM message_logs WHERE id = ?", (log_id,)
+        )
+        row = await cursor.fetchone()
+        if row:
+            return {'username': row['username'], 'content': row['content'], 'guild_id': row['server_id'] or 0}
+    channel = bot.get_channel(channel_id) or await bot.fetch_channel(channel_id)
+    msg = await channel.fetch_message(message_id)
+    return {'username': str(msg.author), 'content': msg.content, 'guild_id': msg.guild.id if msg.guild else 0}
+
 class SaveView(discord.ui.View):
     """View for saving messages from Discord logs channel"""
-    def __init__(self, message: discord.Message = None):
+    def __init__(self, message: discord.Message = None, log_id: int = None):
         super().__init__(timeout=None)
         if message is None:
             return
-        custom_id = f"save|{message.author.id}|{message.channel.id}|{message.id}"
+        custom_id = f"save|{message.author.id}|{message.channel.id}|{message.id}|{log_id or 0}"
         self.add_item(discord.ui.Button(label="Save", style=discord.ButtonStyle.primary, custom_id=custom_id))
 
     async def interaction_check(self, interaction: discord.Interaction):
         parts = interaction.data["custom_id"].split("|")
-        _, user_id, channel_id, message_id = parts
-        channel = bot.get_channel(int(channel_id))
-        msg = await channel.fetch_message(int(message_id))
+        # Buttons sent before log ids were added have four parts
+        _, user_id, channel_id, message_id, log_id = parts if len(parts) == 5 else parts + ['0']
+        try:
+            source = await find_saved_source(int(channel_id), int(message_id), int(log_id))
+        except (discord.NotFound, discord.Forbidden):
+            await interaction.response.send_message("❌ This message is no longer available", ephemeral=True)
+            return False
         
-        waiting_users[interaction.user.id] = {
+        await waiting_users.set(interaction.user.id, {
             "user_id": int(user_id),
-            "username": str(msg.author),
-            "content": msg.content,
+            "username": source['username'],
+            "content": source['content'],
             "channel_id": int(channel_id),
             "message_id": int(message_id),
-            "guild_id": msg.guild.id if msg.guild else 0
-        }
+            "guild_id": source['guild_id']
+        })
         await interaction.response.send_message("Send folder name or 'default':", ephemeral=True)
         return False
 
@@ -841,28 +3326,262 @@ async def on_ready():
     
     bot.add_view(SaveView())
     
+    await publish_guild_snapshot()
+    global status_task
+    if status_task is None:
+        # First ready only: on_ready fires again after reconnects, and resuming twice would run jobs twice
+        status_task = asyncio.create_task(publish_bot_status())
+        asyncio.create_task(resume_bulk_jobs())
+        asyncio.create_task(resume_lockdowns())
+    
     print(f"[BOT] + Bot ready: {bot.user}")
     print(f"   Guilds: {len(bot.guilds)}")
+    if SHARDED:
+        print(f"   Shards: {sorted(bot.shards)} of {bot.shard_count}")
     print(f"   Logs channel: {logs_channel}")
 
+@bot.event
+async def on_shard_ready(shard_id):
+    await publish_guild_snapshot([shard_id])
+
+@bot.event
+async def on_shard_disconnect(shard_id):
+    await publish_guild_state('status', [shard_id])
+
+@bot.event
+async def on_shard_resumed(shard_id):
+    await publish_guild_state('status', [shard_id])
+
+async def publish_stats():
+    """Push global totals to 'stats' subscribers"""
+    total_members, active_servers = guild_registry.stats()
+    await broadcast('stats_update', {'totalMembers': total_members, 'activeServers': active_servers}, ['stats'])
+
+@bot.event
+async def on_guild_join(guild):
+    await publish_guild_state('upsert', guild=guild_entry(guild))
+    await publish_stats()
+
+@bot.event
+async def on_guild_remove(guild):
+    await publish_guild_state('remove', id=guild.id)
+    await publish_stats()
+
+@bot.event
+async def on_guild_update(before, after):
+    if (before.name, before.icon) != (after.name, after.icon):
+        await publish_guild_state('upsert', guild=guild_entry(after))
+
+@bot.event
+async def on_member_join(member):
+    member_count_changed(member.guild)
+    if setting_enabled(member.guild.id, 'autoModeration'):
+        await check_raid(member)
+    if not member.bot and setting_enabled(member.guild.id, 'welcomeMessages'):
+        queue_welcome(member)
+
+@bot.event
+async def on_member_remove(member):
+    member_count_changed(member.guild)
+
+async def check_flood(message):
+    """Timeout users and slow channels that go over the message rate; True if the user was muted"""
+    guild = message.guild
+    # Channel rates also tell the guild-wide check which channels are active
+    if (SPAM_CHANNEL_MESSAGES or SPAM_GUILD_MESSAGES) and message.channel.id not in slowed_channels:
+        if channel_messages.hit(message.channel.id) > SPAM_CHANNEL_MESSAGES > 0:
+            asyncio.create_task(slow_channel(message.channel))
+    if SPAM_GUILD_MESSAGES and guild.id not in slowed_guilds:
+        if guild_messages.hit(guild.id) > SPAM_GUILD_MESSAGES:
+            slow_guild(guild)
+    if SPAM_USER_MESSAGES and user_messages.hit(member_key(guild.id, message.author.id)) > SPAM_USER_MESSAGES:
+        if message.author.is_timed_out():
+            return True
+        try:
+            await mute_member(message.author, parse_duration(SPAM_TIMEOUT), "Flood detection")
+        except discord.Forbidden:
+            return False
+        outbound.post(message.channel.id, 'notice', message.channel.send,
+                      f"🔇 {message.author.mention} muted for {SPAM_TIMEOUT}: flooding", delete_after=10)
+        return True
+    return False
+
+async def slow_channel(channel):
+    slowed_channels.add(channel.id)
+    previous = channel.slowmode_delay
+    try:
+        await channel.edit(slowmode_delay=max(previous, SPAM_SLOWMODE), reason="Flood detection")
+    except (discord.Forbidden, discord.NotFound):
+        slowed_channels.discard(channel.id)
+        return
+    await remember_lockdown('channel', channel.id, channel.guild.id, previous)
+    await end_lockdown('channel', channel.guild, channel.id, previous, RAID_LOCKDOWN)
+
+def slow_guild(guild):
+    """Slow every channel that had messages in the window; members already in the guild are
+    the ones flooding, so verification (which only stops new joins) is left alone"""
+    slowed_guilds.add(guild.id)
+    asyncio.get_running_loop().call_later(SPAM_WINDOW, slowed_guilds.discard, guild.id)
+    for channel in guild.text_channels:
+        if channel.id in channel_messages.keys and channel.id not in slowed_channels:
+            asyncio.create_task(slow_channel(channel))
+
+async def check_raid(member):
+    guild = member.guild
+    if not RAID_JOINS or guild.id in raid_lockdowns:
+        return
+    if guild_joins.hit(guild.id) > RAID_JOINS:
+        asyncio.create_task(lock_down_guild(guild, f"More than {RAID_JOINS} joins in {RAID_WINDOW}s"))
+
+async def lock_down_guild(guild, cause):
+    """Raise the verification level while a guild is flooded, then restore it"""
+    raid_lockdowns.add(guild.id)
+    previous = guild.verification_level
+    try:
+        await guild.edit(verification_level=discord.VerificationLevel.highest, reason="Raid detection")
+    except discord.Forbidden:
+        raid_lockdowns.discard(guild.id)
+        return
+    await remember_lockdown('guild', guild.id, guild.id, previous.value)
+    if big_action_channel and setting_enabled(guild.id, 'bigActions'):
+        outbound.post(big_action_channel.id, 'notice', big_action_channel.send, embed=discord.Embed(
+            title="🚨 RAID",
+            description=f"{cause} on **{guild.name}** - verification raised for {RAID_LOCKDOWN // 60} min",
+            color=DARK_RED
+        ))
+    await end_lockdown('guild', guild, guild.id, previous.value, RAID_LOCKDOWN)
+
+async def remember_lockdown(kind, target_id, guild_id, previous):
+    """Store what to restore, so a restart still lifts the lockdown"""
+    await db_conn.execute(
+        "INSERT OR REPLACE INTO flood_lockdowns (kind, target_id, guild_id, previous, expires_at) VALUES (?, ?, ?, ?, ?)",
+        (kind, target_id, guild_id, previous, time.time() + RAID_LOCKDOWN)
+    )
+    await db_conn.commit()
+
+async def end_lockdown(kind, guild, target_id, previous, delay):
+    """Restore the slowmode or verification level after delay seconds"""
+    await asyncio.sleep(delay)
+    try:
+        if kind == 'guild':
+            await guild.edit(verification_level=discord.VerificationLevel(previous), reason="Raid lockdown ended")
+        else:
+            channel = guild.get_channel(target_id)
+            if channel:
+                await channel.edit(slowmode_delay=previous, reason="Flood detection ended")
+    except (discord.Forbidden, discord.NotFound):
+        pass
+    finally:
+        (raid_lockdowns if kind == 'guild' else slowed_channels).discard(target_id)
+        await db_conn.execute("DELETE FROM flood_lockdowns WHERE kind = ? AND target_id = ?", (kind, target_id))
+        await db_conn.commit()
+
+async def resume_lockdowns():
+    """Schedule the end of lockdowns started before a restart, for the guilds this process serves"""
+    cursor = await db_conn.execute("SELECT kind, target_id, guild_id, previous, expires_at FROM flood_lockdowns")
+    for r in await cursor.fetchall():
+        guild = bot.get_guild(r['guild_id'])
+        active = raid_lockdowns if r['kind'] == 'guild' else slowed_channels
+        if guild is None or r['target_id'] in active:
+            continue
+        active.add(r['target_id'])
+        delay = max(0, r['expires_at'] - time.time())
+        asyncio.create_task(end_lockdown(r['kind'], guild, r['target_id'], r['previous'], delay))
+
+welcome_buffers = {}  # guild id -> [mentions, total joins] waiting for the window to close
+
+def queue_welcome(member):
+    buffer = welcome_buffers.get(member.guild.id)
+    if buffer is None:
+        buffer = welcome_buffers[member.guild.id] = [[], 0]
+        asyncio.create_task(flush_welcome(member.guild))
+    if len(buffer[0]) < WELCOME_MAX_MENTIONS:
+        buffer[0].append(member.mention)
+    buffer[1] += 1
+
+async def flush_welcome(guild):
+    """One welcome message per guild per window, however many joined"""
+    await asyncio.sleep(WELCOME_WINDOW)
+    mentions, total = welcome_buffers.pop(guild.id)
+    channel = guild.system_channel
+    if channel is None:
+        return
+    text = f"👋 Добро пожаловать, {', '.join(mentions)}"
+    if total > len(mentions):
+        text += f" и ещё {total - len(mentions)}"
+    outbound.post(channel.id, 'notice', channel.send, text + "!")
+
+async def enforce_automod(message, rule):
+    try:
+        await message.delete()
+    except (discord.NotFound, discord.Forbidden):
+        return
+    if rule['action'] == 'warn':
+        outbound.post(message.channel.id, 'notice', message.channel.send,
+                      f"⚠️ {message.author.mention}, your message was removed by auto-moderation", delete_after=10)
+
 @bot.event
 async def on_message(message: discord.Message):
     if message.author == bot.user:
         return
     
+    guild_id = message.guild.id if message.guild else 0
+    
     # Process commands first
-    if message.content.startswith(bot.command_prefix):
-        await bot.process_commands(message)
+    if message.content.startswith(guild_setting(guild_id, 'prefix')):
+        if not message.author.bot:
+            await bot.invoke(await bot.get_context(message, cls=OutboundContext))
+        return
+    
+    # Auto-moderation (moderators are exempt)
+    if (message.guild and not message.author.bot and setting_enabled(guild_id, 'autoModeration')
+            and not message.author.guild_permissions.manage_messages):
+        rule = automod_check(guild_id, message.content)
+        if rule:
+            await enforce_automod(message, rule)
+            return
+        if await check_flood(message):
+            return
+    
+    # Answer a pending Save before the logging work below
+    saved = await waiting_users.pop(message.author.id)
+    if saved:
+        folder = message.content.strip().lower()
+        if folder in ['no', 'none', '-', '']:
+            folder = 'default'
+        
+        await db_conn.execute("""
+            INSERT INTO saved_msg (user_id, saved_by, folder, username, content, timestamp, channel_id, message_id, guild_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (saved['user_id'], message.author.id, folder, saved['username'], saved['content'],
+              datetime.now(timezone.utc).isoformat(), saved['channel_id'], saved['message_id'], saved['guild_id']))
+        await db_conn.commit()
+        
+        await outbound.send(message.channel.id, 'interactive', message.reply, f"✅ Saved to folder: `{folder}`")
+    
+    if not setting_enabled(guild_id, 'serverLogs'):
         return
     
     # Log message to database
+    log_id = None
     if message.guild:
-        await db_conn.execute("""
-            INSERT INTO message_logs (server_id, server_name, channel_id, channel_name, user_id, username, content)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
+        cursor = await db_conn.execute("""
+            INSERT INTO message_logs (server_id, server_name, channel_id, channel_name, user_id, username, content, message_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
         """, (message.guild.id, message.guild.name, message.channel.id, message.channel.name,
-              message.author.id, str(message.author), message.content))
+              message.author.id, str(message.author), message.content, message.id))
         await db_conn.commit()
+        log_id = cursor.lastrowid
+        
+        topics = ['logs'] + [f'logs:{f}' for f in server_folder_ids.get(message.guild.id, ())]
+        await broadcast('new_log', {
+            'server_name': message.guild.name,
+            'channel_name': message.channel.name,
+            'username': str(message.author),
+            'user_id': str(message.author.id),
+            'content': message.content,
+            'created_at': datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        }, topics)
     
     # Send to Discord logs channel
     if logs_channel:
@@ -873,74 +3592,156 @@ async def on_message(message: discord.Message):
         )
         if message.author.avatar:
             embed.set_author(name=str(message.author), icon_url=message.author.avatar.url)
-        view = SaveView(message)
-        await logs_channel.send(embed=embed, view=view)
+        remember_message(message)
+        view = SaveView(message, log_id)
+        outbound.post(logs_channel.id, 'bulk', logs_channel.send, embed=embed, view=view)
     
-    # Handle waiting save requests
-    user_id = message.author.id
-    if user_id in waiting_users:
-        folder = message.content.strip().lower()
-        if folder in ['no', 'none', '-', '']:
-            folder = 'default'
-        
-        saved = waiting_users[user_id]
-        await db_conn.execute("""
-            INSERT INTO saved_msg (user_id, folder, username, content, timestamp, channel_id, message_id, guild_id)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """, (saved['user_id'], folder, saved['username'], saved['content'],
-              datetime.now(timezone.utc).isoformat(), saved['channel_id'], saved['message_id'], saved['guild_id']))
-        await db_conn.commit()
-        
-        await message.reply(f"✅ Saved to folder: `{folder}`")
-        del waiting_users[user_id]
-
 # --- BOT COMMANDS ---
 
+class NotBotAdmin(commands.CheckFailure):
+    pass
+
+def bot_admin_only():
+    """Command check for users in bot_admins (or the owner), answered from memory"""
+    async def predicate(ctx):
+        if not is_bot_admin(ctx.author.id):
+            raise NotBotAdmin()
+        return True
+    return commands.check(predicate)
+
+@bot.event
+async def on_command_error(ctx, error):
+    if isinstance(error, NotBotAdmin):
+        return await ctx.send("X Not authorized")
+    await commands.Bot.on_command_error(bot, ctx, error)
+
 @bot.command(name="ping")
 async def cmd_ping(ctx):
-    await ctx.send(f"🏓 Pong! Latency: {round(bot.latency * 1000)}ms")
+    await ctx.send(f"🏓 Pong! Latency: {bot_latency_ms()}ms")
+
+class SavedView(discord.ui.View):
+    """Older/Newer buttons over a user's saved folder; keeps the start cursor of each page seen.
+    owner_id is who may page; saved_by is whose saves are listed (None for legacy saves)"""
+    def __init__(self, owner_id, folder, rows, next_cursor, saved_by=None):
+        super().__init__(timeout=300)
+        self.owner_id = owner_id
+        self.saved_by = saved_by
+        self.folder = folder
+        self.rows = rows
+        self.next_cursor = next_cursor
+        self.page_starts = [None]
+        self.update_buttons()
+    
+    def embed(self):
+        title = f"📁 Saved - {self.folder}" if self.saved_by is not None else f"📁 Legacy saved - {self.folder}"
+        embed = discord.Embed(title=title, color=PSI_YELLOW)
+        for r in self.rows:
+            content = r['content'][:200] + "..." if len(r['content']) > 200 else r['content']
+            embed.add_field(name=r['username'], value=f"```{content}```", inline=False)
+        embed.set_footer(text=f"Page {len(self.page_starts)}")
+        return embed
+    
+    def update_buttons(self):
+        self.newer.disabled = len(self.page_starts) == 1
+        self.older.disabled = self.next_cursor is None
+    
+    async def interaction_check(self, interaction: discord.Interaction):
+        if interaction.user.id != self.owner_id:
+            await interaction.response.send_message("X Not your saved messages", ephemeral=True)
+            return False
+        return True
+    
+    async def show(self, interaction, start):
+        self.rows, self.next_cursor = await fetch_saved(self.saved_by, self.folder, start)
+        self.update_buttons()
+        await interaction.response.edit_message(embed=self.embed(), view=self)
+    
+    @discord.ui.button(label="◀ Newer", style=discord.ButtonStyle.secondary)
+    async def newer(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.page_starts.pop()
+        await self.show(interaction, self.page_starts[-1])
+    
+    @discord.ui.button(label="Older ▶", style=discord.ButtonStyle.secondary)
+    async def older(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.page_starts.append(self.next_cursor)
+        await self.show(interaction, self.next_cursor)
 
 @bot.command(name="show_saved")
 async def cmd_show_saved(ctx, folder: str = "default"):
-    cursor = await db_conn.execute("""
-        SELECT username, content, timestamp FROM saved_msg WHERE folder = ? ORDER BY timestamp DESC LIMIT 10
-    """, (folder,))
-    rows = await cursor.fetchall()
+    rows, next_cursor = await fetch_saved(ctx.author.id, folder)
     
     if not rows:
         return await ctx.send(f"No messages in folder `{folder}`")
     
-    embed = discord.Embed(title=f"📁 Saved - {folder}", color=PSI_YELLOW)
-    for r in rows:
-        content = r['content'][:200] + "..." if len(r['content']) > 200 else r['content']
-        embed.add_field(name=r['username'], value=f"```{content}```", inline=False)
+    view = SavedView(ctx.author.id, folder, rows, next_cursor, ctx.author.id)
+    await ctx.send(embed=view.embed(), view=view)
+
+@bot.command(name="legacy_saved")
+async def cmd_legacy_saved(ctx, folder: str = "default"):
+    """Saves made before the saver was recorded, shared by folder as they always were"""
+    rows, next_cursor = await fetch_saved(None, folder)
     
-    await ctx.send(embed=embed)
+    if not rows:
+        return await ctx.send(f"No legacy messages in folder `{folder}`")
+    
+    view = SavedView(ctx.author.id, folder, rows, next_cursor)
+    await ctx.send(embed=view.embed(), view=view)
 
 @bot.command(name="global_send")
+@bot_admin_only()
 async def cmd_global_send(ctx, channel_id: int, *, content: str):
-    # Check if admin
-    cursor = await db_conn.execute("SELECT 1 FROM bot_admins WHERE user_id = ?", (ctx.author.id,))
-    is_admin = await cursor.fetchone() or ctx.author.id == OWNER_ID
-    
-    if not is_admin:
-        return await ctx.send("X Not authorized")
-    
     channel = bot.get_channel(channel_id)
     if not channel:
         return await ctx.send("X Channel not found")
     
-    sent = await channel.send(content)
+    sent = await outbound.send(channel.id, 'notice', channel.send, content)
     await ctx.send(f"+ Sent: {sent.jump_url}")
 
+class BroadcastFlags(commands.FlagConverter):
+    folder: str = None
+    servers: str = None
+    channels: str = None
+    channel: str = None
+    message: str
+
+@bot.command(name="broadcast")
+@bot_admin_only()
+async def cmd_broadcast(ctx, *, flags: BroadcastFlags):
+    """broadcast folder: <name or id> | servers: <ids> | channels: <ids> [channel: #name] message: <text>"""
+    server_ids = {int(i) for i in re.findall(r"\d{15,20}", flags.servers or "")}
+    channel_ids = {int(i) for i in re.findall(r"\d{15,20}", flags.channels or "")}
+    if flags.folder:
+        cursor = await db_conn.execute("SELECT id FROM folders WHERE id = ? OR name = ?", (flags.folder, flags.folder))
+        folder = await cursor.fetchone()
+        if folder is None:
+            return await ctx.send("X Folder not found")
+        server_ids |= folder_servers.get(folder['id'], set())
+    if not server_ids and not channel_ids:
+        return await ctx.send("X No targets")
+    
+    status = await ctx.send(f"Sending to {len(server_ids) + len(channel_ids)} targets...")
+    report = await run_broadcast(flags.message, server_ids, channel_ids, flags.channel)
+    lines = [f"+ Sent: {report['sent']}, X Failed: {report['failed']}"]
+    lines += [f"X {r['serverId'] or r['channelId']}: {r.get('error', r['status'])}"
+              for r in report['results'] if r['status'] != 'sent'][:15]
+    lines += [f"X {error}" for error in report.get('errors', [])]
+    await status.edit(content="\n".join(lines))
+
 # --- MODERATION COMMANDS ---
 
+async def log_moderation(ctx, action, member, details):
+    await record_actions([(action, str(ctx.author.id), str(ctx.author), 'user', str(member.id), str(member),
+                           details, str(ctx.guild.id), ctx.guild.name)])
+    await db_conn.commit()
+
 @bot.command(name="ban")
 @commands.has_permissions(ban_members=True)
+@members_loaded()
 async def cmd_ban(ctx, member: discord.Member, *, reason: str = "Не указана"):
     """Забанить пользователя"""
     try:
         await member.ban(reason=f"{reason} (by {ctx.author})")
+        await log_moderation(ctx, 'ban', member, reason)
         embed = discord.Embed(
             title="🔨 Бан",
             description=f"**{member}** забанен\nПричина: {reason}",
@@ -949,7 +3750,7 @@ async def cmd_ban(ctx, member: discord.Member, *, reason: str = "Не указа
         await ctx.send(embed=embed)
         
         # Log to big_action_channel
-        if big_action_channel:
+        if big_action_channel and setting_enabled(ctx.guild.id, 'bigActions'):
             log_embed = discord.Embed(
                 title="🔨 BAN",
                 description=f"**{member}** забанен на {ctx.guild.name}",
@@ -957,16 +3758,18 @@ async def cmd_ban(ctx, member: discord.Member, *, reason: str = "Не указа
             )
             log_embed.add_field(name="Модератор", value=str(ctx.author))
             log_embed.add_field(name="Причина", value=reason)
-            await big_action_channel.send(embed=log_embed)
+            outbound.post(big_action_channel.id, 'notice', big_action_channel.send, embed=log_embed)
     except discord.Forbidden:
         await ctx.send("❌ Недостаточно прав для бана этого пользователя")
 
 @bot.command(name="kick")
 @commands.has_permissions(kick_members=True)
+@members_loaded()
 async def cmd_kick(ctx, member: discord.Member, *, reason: str = "Не указана"):
     """Кикнуть пользователя"""
     try:
         await member.kick(reason=f"{reason} (by {ctx.author})")
+        await log_moderation(ctx, 'kick', member, reason)
         embed = discord.Embed(
             title="👢 Кик",
             description=f"**{member}** кикнут\nПричина: {reason}",
@@ -976,24 +3779,30 @@ async def cmd_kick(ctx, member: discord.Member, *, reason: str = "Не указ
     except discord.Forbidden:
         await ctx.send("❌ Недостаточно прав для кика этого пользователя")
 
+def parse_duration(text):
+    """'10s', '5m', '1h' or '1d' as a timedelta, None if malformed"""
+    match = re.match(r"(\d+)([smhd])", text.lower())
+    if not match:
+        return None
+    amount, unit = int(match.group(1)), match.group(2)
+    units = {"s": "seconds", "m": "minutes", "h": "hours", "d": "days"}
+    return timedelta(**{units[unit]: amount})
+
+async def mute_member(member, delta, reason):
+    await member.timeout(delta, reason=reason)
+
 @bot.command(name="mute")
 @commands.has_permissions(moderate_members=True)
+@members_loaded()
 async def cmd_mute(ctx, member: discord.Member, duration: str = "10m", *, reason: str = "Не указана"):
     """Замутить пользователя. Время: 10s, 5m, 1h, 1d"""
-    import re
-    from datetime import timedelta
-    
-    # Parse duration
-    match = re.match(r"(\d+)([smhd])", duration.lower())
-    if not match:
+    delta = parse_duration(duration)
+    if delta is None:
         return await ctx.send("❌ Неверный формат времени. Используйте: 10s, 5m, 1h, 1d")
     
-    amount, unit = int(match.group(1)), match.group(2)
-    units = {"s": "seconds", "m": "minutes", "h": "hours", "d": "days"}
-    delta = timedelta(**{units[unit]: amount})
-    
     try:
-        await member.timeout(delta, reason=f"{reason} (by {ctx.author})")
+        await mute_member(member, delta, f"{reason} (by {ctx.author})")
+        await log_moderation(ctx, 'mute', member, f"{reason} ({duration})")
         embed = discord.Embed(
             title="🔇 Мут",
             description=f"**{member}** замучен на {duration}\nПричина: {reason}",
@@ -1003,18 +3812,403 @@ async def cmd_mute(ctx, member: discord.Member, duration: str = "10m", *, reason
     except discord.Forbidden:
         await ctx.send("❌ Недостаточно прав для мута этого пользователя")
 
+purge_jobs = {}  # channel id -> running PurgeJob
+
+def purge_bound(text):
+    """A message id, or a duration meaning that long ago; None if malformed"""
+    if text.isdigit():
+        return discord.Object(int(text))
+    delta = parse_duration(text)
+    return discord.utils.utcnow() - delta if delta else None
+
+class PurgeFlags(commands.FlagConverter):
+    user: discord.User = None
+    match: str = None
+    attachments: bool = False
+    after: str = None
+    before: str = None
+
+class PurgeView(discord.ui.View):
+    """Cancel button under the purge progress message"""
+    def __init__(self, job):
+        super().__init__(timeout=None)
+        self.job = job
+
+    async def interaction_check(self, interaction: discord.Interaction):
+        if interaction.user.id != self.job.author_id and not interaction.permissions.manage_messages:
+            await interaction.response.send_message("❌ Недостаточно прав", ephemeral=True)
+            return False
+        return True
+
+    @discord.ui.button(label="Отменить", style=discord.ButtonStyle.danger)
+    async def cancel(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.job.cancelled = True
+        await interaction.response.defer()
+
+class PurgeJob:
+    """Deletes up to `count` matching messages: bulk batches of 100 for the last 14 days,
+    a throttled one-by-one queue for older ones"""
+    def __init__(self, channel, author_id, count, flags):
+        self.channel = channel
+        self.author_id = author_id
+        self.count = count
+        self.flags = flags
+        self.after = purge_bound(flags.after) if flags.after else None
+        self.before = purge_bound(flags.before) if flags.before else None
+        self.pattern = re.compile(flags.match, re.IGNORECASE) if flags.match else None
+        self.scanned = 0
+        self.matched = 0
+        self.deleted = 0
+        self.cancelled = False
+        self.error = None
+        self.progress_message = None
+        self.progress_throttle = Throttle(2)
+
+    def wanted(self, message):
+        if self.flags.user and message.author.id != self.flags.user.id:
+            return False
+        if self.flags.attachments and not message.attachments:
+            return False
+        if self.pattern and not self.pattern.search(message.content):
+            return False
+        return True
+
+    async def run(self, before):
+        self.progress_message = await outbound.send(self.channel.id, 'interactive', self.channel.send,
+                                                    self.status(), view=PurgeView(self))
+        # Bulk delete only accepts messages under 14 days old; leave a margin for the scan itself
+        cutoff = discord.utils.utcnow() - timedelta(days=14, minutes=-10)
+        old_queue = asyncio.Queue()
+        old_worker = asyncio.create_task(self.delete_old(old_queue))
+        batch = []
+        try:
+            async for message in self.channel.history(limit=PURGE_SCAN_MAX, before=self.before or before,
+                                                      after=self.after, oldest_first=False):
+                if self.cancelled or self.error:
+                    break
+                self.scanned += 1
+                if not self.wanted(message):
+                    continue
+                self.matched += 1
+                if message.created_at > cutoff:
+                    batch.append(message)
+                    if len(batch) == 100:
+                        await self.delete_batch(batch)
+                        batch = []
+                else:
+                    old_queue.put_nowait(message)
+                if self.matched >= self.count:
+                    break
+                await self.update_progress()
+            if batch and not self.cancelled:
+                await self.delete_batch(batch)
+        except discord.Forbidden:
+            self.error = "❌ Недостаточно прав для удаления сообщений"
+        finally:
+            old_queue.put_nowait(None)
+            await old_worker
+        await self.update_progress(final=True)
+
+    async def delete_batch(self, batch):
+        try:
+            await self.channel.delete_messages(batch)
+            self.deleted += len(batch)
+        except discord.NotFound:
+            # Someone removed one of them first; fall back to one at a time
+            for message in batch:
+                await self.delete_one(message)
+        await self.update_progress()
+
+    async def delete_one(self, message):
+        try:
+            await message.delete()
+            self.deleted += 1
+        except discord.NotFound:
+            pass
+        except discord.Forbidden:
+            self.error = "❌ Недостаточно прав для удаления сообщений"
+
+    async def delete_old(self, queue):
+        """Old messages, PURGE_OLD_RATE requests per second"""
+        pacer = Pacer(PURGE_OLD_RATE)
+        while (message := await queue.get()) is not None:
+            if self.cancelled or self.error:
+                continue
+            await pacer.wait()
+            await self.delete_one(message)
+            await self.update_progress()
+
+    def status(self, final=False):
+        if self.error:
+            return f"{self.error} (удалено {self.deleted})"
+        if not final:
+            return f"🗑️ Удаление... {self.deleted}/{self.count} (просмотрено {self.scanned})"
+        if self.cancelled:
+            return f"⛔ Отменено, удалено {self.deleted} сообщений"
+        return f"🗑️ Удалено {self.deleted} сообщений"
+
+    async def update_progress(self, final=False):
+        """Edit the progress message; the final state always goes through"""
+        if not self.progress_throttle.ready(final):
+            return
+        try:
+            if final:
+                await self.progress_message.edit(content=self.status(True), view=None, delete_after=10)
+            else:
+                await self.progress_message.edit(content=self.status())
+        except discord.HTTPException:
+            pass
+
 @bot.command(name="clear")
 @commands.has_permissions(manage_messages=True)
-async def cmd_clear(ctx, count: int = 10):
-    """Удалить сообщения (1-100)"""
-    count = max(1, min(100, count))
+async def cmd_clear(ctx, count: Optional[int] = 10, *, flags: PurgeFlags):
+    """Удалить сообщения: clear 500 user: @кто match: текст attachments: yes after: 2h before: 10m"""
+    # Optional lets the count be left out (`clear user: @x`) instead of failing on the first flag
+    if any(bound and purge_bound(bound) is None for bound in (flags.after, flags.before)):
+        return await ctx.send("❌ Неверный формат времени. Используйте: 10s, 5m, 1h, 1d или ID сообщения")
+    if flags.match:
+        try:
+            re.compile(flags.match)
+        except re.error:
+            return await ctx.send("❌ Неверное регулярное выражение")
+    count = max(1, min(PURGE_MAX, count))
+    # Check and claim the channel with no await in between
+    if ctx.channel.id in purge_jobs:
+        return await ctx.send("❌ В этом канале уже идёт удаление")
+    job = purge_jobs[ctx.channel.id] = PurgeJob(ctx.channel, ctx.author.id, count, flags)
     try:
-        deleted = await ctx.channel.purge(limit=count + 1)  # +1 for command message
-        msg = await ctx.send(f"🗑️ Удалено {len(deleted) - 1} сообщений")
-        await asyncio.sleep(3)
-        await msg.delete()
-    except discord.Forbidden:
-        await ctx.send("❌ Недостаточно прав для удаления сообщений")
+        try:
+            await ctx.message.delete()
+        except discord.HTTPException:
+            pass
+        await job.run(ctx.message)
+    finally:
+        purge_jobs.pop(ctx.channel.id, None)
+    await record_actions([('purge', str(ctx.author.id), str(ctx.author), 'channel', str(ctx.channel.id), ctx.channel.name,
+                           f"{job.deleted} messages", str(ctx.guild.id), ctx.guild.name)])
+    await db_conn.commit()
+
+# --- BULK MODERATION ---
+BULK_TITLES = {'ban': "🔨 Массовый бан", 'kick': "👢 Массовый кик", 'mute': "🔇 Массовый мут"}
+bulk_jobs = {}  # job id -> running BulkJob
+bulk_pacer = Pacer(BULK_RATE)  # shared by every job, so BULK_RATE holds however many run at once
+
+class BulkFlags(commands.FlagConverter):
+    ids: str = None
+    role: discord.Role = None
+    joined: str = None
+    reason: str = "Не указана"
+    duration: str = "10m"
+
+class BulkJob:
+    """One bulk ban/kick/mute run; progress is stored in bulk_jobs/bulk_job_targets so it can resume"""
+    def __init__(self, row, guild, channel):
+        self.id = row['id']
+        self.action = row['action']
+        self.reason = row['reason']
+        self.duration = row['duration']
+        self.actor_id = row['actor_id']
+        self.actor_name = row['actor_name']
+        self.total, self.done, self.failed = row['total'], row['done'], row['failed']
+        self.guild = guild
+        self.channel = channel
+        self.progress_message = channel.get_partial_message(row['progress_message_id']) if row['progress_message_id'] else None
+        self.cancelled = False
+        self.results = []  # (user id, status, error) not yet written
+        self.progress_throttle = Throttle(2)
+    
+    async def run(self, user_ids):
+        bulk_jobs[self.id] = self
+        # Discord bans up to 200 users per request; kicks and timeouts are one per user
+        size = 200 if self.action == 'ban' else 1
+        queue = asyncio.Queue()
+        for i in range(0, len(user_ids), size):
+            queue.put_nowait(user_ids[i:i + size])
+        try:
+            await asyncio.gather(*(self.worker(queue) for _ in range(max(1, min(BULK_CONCURRENCY, queue.qsize())))))
+        except asyncio.CancelledError:
+            # Shutting down: keep what finished and leave the job 'running' so it resumes
+            await self.flush()
+            raise
+        finally:
+            bulk_jobs.pop(self.id, None)
+        await self.flush()
+        status = 'cancelled' if self.cancelled else 'done'
+        await db_conn.execute("UPDATE bulk_jobs SET status = ? WHERE id = ?", (status, self.id))
+        await db_conn.commit()
+        await self.update_progress(final=True)
+    
+    async def worker(self, queue):
+        while not self.cancelled and not queue.empty():
+            batch = queue.get_nowait()
+            await bulk_pacer.wait()
+            for user_id, status, error in await self.apply(batch):
+                self.results.append((user_id, status, error))
+                if status == 'done':
+                    self.done += 1
+                else:
+                    self.failed += 1
+            if len(self.results) >= 50:
+                await self.flush()
+            await self.update_progress()
+    
+    async def apply(self, batch):
+        reason = f"{self.reason} (bulk #{self.id} by {self.actor_name})"
+        try:
+            if self.action == 'ban':
+                result = await self.guild.bulk_ban([discord.Object(i) for i in batch], reason=reason, delete_message_seconds=0)
+                banned = {user.id for user in result.banned}
+                return [(i, 'done', None) if i in banned else (i, 'failed', 'Not banned') for i in batch]
+            user_id = batch[0]
+            if self.action == 'kick':
+                await self.guild.kick(discord.Object(user_id), reason=reason)
+            else:
+                duration = parse_duration(self.duration)
+                if duration is None:
+                    return [(user_id, 'failed', f"Invalid duration {self.duration!r}")]
+                member = self.guild.get_member(user_id)
+                if member is None:
+                    await bulk_pacer.wait()
+                    member = await self.guild.fetch_member(user_id)
+                await mute_member(member, duration, reason)
+            return [(user_id, 'done', None)]
+        except discord.HTTPException as e:
+            return [(i, 'failed', e.text or str(e.status)) for i in batch]
+        except Exception as e:
+            # Anything else would end the worker group and strand the job as 'running'
+            print(f"[BOT] X Bulk {self.action} #{self.id} failed for {batch[0]}: {e!r}")
+            return [(i, 'failed', str(e) or type(e).__name__) for i in batch]
+    
+    async def flush(self):
+        """Write finished targets and their action log rows in one transaction"""
+        results, self.results = self.results, []
+        if not results:
+            return
+        await db_conn.executemany(
+            "UPDATE bulk_job_targets SET status = ?, error = ? WHERE job_id = ? AND user_id = ?",
+            [(status, error, self.id, user_id) for user_id, status, error in results]
+        )
+        details = f"{self.reason} (bulk #{self.id})"
+        await record_actions([
+            (self.action, str(self.actor_id), self.actor_name, 'user', str(user_id), None, details, str(self.guild.id), self.guild.name)
+            for user_id, status, _ in results if status == 'done'
+        ])
+        await db_conn.execute("UPDATE bulk_jobs SET done = ?, failed = ? WHERE id = ?", (self.done, self.failed, self.id))
+        await db_conn.commit()
+    
+    def embed(self, final):
+        if not final:
+            state = "⏳ В процессе"
+        else:
+            state = "⛔ Отменено" if self.cancelled else "✅ Завершено"
+        embed = discord.Embed(title=f"{BULK_TITLES[self.action]} #{self.id}", color=DARK_RED)
+        embed.add_field(name="Готово", value=f"{self.done}/{self.total}")
+        embed.add_field(name="Ошибок", value=self.failed)
+        embed.add_field(name="Статус", value=state)
+        embed.add_field(name="Причина", value=self.reason, inline=False)
+        if not final:
+            embed.set_footer(text=f"Остановить: bulk_cancel {self.id}")
+        return embed
+    
+    async def update_progress(self, final=False):
+        """Refresh the embed on the job's progress message"""
+        if not self.progress_throttle.ready(final):
+            return
+        try:
+            if self.progress_message:
+                await self.progress_message.edit(embed=self.embed(final))
+        except discord.HTTPException:
+            pass
+
+async def resolve_bulk_targets(ctx, flags):
+    """User ids from ids:, an attached list, and members matching role: and/or joined:"""
+    ids = set()
+    if flags.ids:
+        ids.update(int(match) for match in re.findall(r"\d{15,20}", flags.ids))
+    for attachment in ctx.message.attachments:
+        if attachment.size <= 1024 * 1024:
+            ids.update(int(match) for match in re.findall(rb"\d{15,20}", await attachment.read()))
+    if flags.role or flags.joined:
+        since = discord.utils.utcnow() - parse_duration(flags.joined) if flags.joined else None
+        members = flags.role.members if flags.role else ctx.guild.members
+        ids.update(m.id for m in members if since is None or (m.joined_at and m.joined_at >= since))
+    ids -= {ctx.author.id, bot.user.id, ctx.guild.owner_id}
+    return sorted(ids)
+
+async def start_bulk_job(ctx, action, flags):
+    if flags.joined and parse_duration(flags.joined) is None:
+        return await ctx.send("❌ Неверный формат времени. Используйте: 10s, 5m, 1h, 1d")
+    if action == 'mute' and parse_duration(flags.duration) is None:
+        return await ctx.send("❌ Неверный формат времени. Используйте: 10s, 5m, 1h, 1d")
+    user_ids = await resolve_bulk_targets(ctx, flags)
+    if not user_ids:
+        return await ctx.send("❌ Не найдено ни одного пользователя")
+    if len(user_ids) > BULK_MAX_TARGETS:
+        return await ctx.send(f"❌ Слишком много пользователей ({len(user_ids)}), максимум {BULK_MAX_TARGETS}")
+    
+    cursor = await db_conn.execute("""
+        INSERT INTO bulk_jobs (guild_id, channel_id, action, reason, duration, actor_id, actor_name, total)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, (ctx.guild.id, ctx.channel.id, action, flags.reason, flags.duration, ctx.author.id, str(ctx.author), len(user_ids)))
+    job_id = cursor.lastrowid
+    await db_conn.executemany("INSERT INTO bulk_job_targets (job_id, user_id) VALUES (?, ?)", [(job_id, i) for i in user_ids])
+    await db_conn.commit()
+    
+    row = {'id': job_id, 'action': action, 'reason': flags.reason, 'duration': flags.duration, 'actor_id': ctx.author.id,
+           'actor_name': str(ctx.author), 'total': len(user_ids), 'done': 0, 'failed': 0, 'progress_message_id': None}
+    job = BulkJob(row, ctx.guild, ctx.channel)
+    job.progress_message = await ctx.send(embed=job.embed(False))
+    await db_conn.execute("UPDATE bulk_jobs SET progress_message_id = ? WHERE id = ?", (job.progress_message.id, job_id))
+    await db_conn.commit()
+    asyncio.create_task(job.run(user_ids))
+
+async def resume_bulk_jobs():
+    """Continue runs interrupted by a restart, for the guilds this process serves"""
+    cursor = await db_conn.execute("SELECT * FROM bulk_jobs WHERE status = 'running'")
+    for row in await cursor.fetchall():
+        guild = bot.get_guild(row['guild_id'])
+        if row['id'] in bulk_jobs or guild is None:
+            continue
+        channel = guild.get_channel(row['channel_id'])
+        if channel is None:
+            continue
+        cursor = await db_conn.execute(
+            "SELECT user_id FROM bulk_job_targets WHERE job_id = ? AND status = 'pending' ORDER BY user_id", (row['id'],)
+        )
+        user_ids = [r['user_id'] for r in await cursor.fetchall()]
+        print(f"[BOT] + Resuming bulk {row['action']} #{row['id']} ({len(user_ids)} left)")
+        asyncio.create_task(BulkJob(row, guild, channel).run(user_ids))
+
+@bot.command(name="bulk_ban")
+@commands.has_permissions(ban_members=True)
+@members_loaded()
+async def cmd_bulk_ban(ctx, *, flags: BulkFlags):
+    """Массовый бан: ids: ... / role: @роль / joined: 30m / файл со списком ID; reason: ..."""
+    await start_bulk_job(ctx, 'ban', flags)
+
+@bot.command(name="bulk_kick")
+@commands.has_permissions(kick_members=True)
+@members_loaded()
+async def cmd_bulk_kick(ctx, *, flags: BulkFlags):
+    """Массовый кик (те же параметры, что у bulk_ban)"""
+    await start_bulk_job(ctx, 'kick', flags)
+
+@bot.command(name="bulk_mute")
+@commands.has_permissions(moderate_members=True)
+@members_loaded()
+async def cmd_bulk_mute(ctx, *, flags: BulkFlags):
+    """Массовый мут (те же параметры + duration: 10m)"""
+    await start_bulk_job(ctx, 'mute', flags)
+
+@bot.command(name="bulk_cancel")
+@commands.has_permissions(moderate_members=True)
+async def cmd_bulk_cancel(ctx, job_id: int):
+    """Остановить массовое действие"""
+    job = bulk_jobs.get(job_id)
+    if job is None or job.guild.id != ctx.guild.id:
+        return await ctx.send("❌ Нет активного задания с таким номером")
+    job.cancelled = True
+    await ctx.send(f"⛔ Задание #{job_id} остановлено")
 
 # --- INFO COMMANDS ---
 
@@ -1096,15 +4290,20 @@ async def cmd_userinfo(ctx, member: discord.Member = None):
 @bot.command(name="meme")
 async def cmd_meme(ctx):
     """Случайный мем из базы"""
-    cursor = await db_conn.execute("""
-        SELECT image_url, caption FROM memes ORDER BY RANDOM() LIMIT 1
-    """)
-    meme = await cursor.fetchone()
+    meme_id = meme_pool.pick(ctx.channel.id, weighted=MEME_WEIGHTING == 'likes')
+    meme = None
+    if meme_id is not None:
+        cursor = await db_conn.execute("SELECT image_path, caption FROM memes WHERE id = ?", (meme_id,))
+        meme = await cursor.fetchone()
     
     if meme:
+        filename = os.path.basename(meme['image_path'])
+        filepath = os.path.join(UPLOADS_PATH, filename)
+        if not os.path.exists(filepath):
+            return await ctx.send("😢 Файл мема не найден")
         embed = discord.Embed(description=meme['caption'], color=PSI_YELLOW)
-        embed.set_image(url=meme['image_url'])
-        await ctx.send(embed=embed)
+        embed.set_image(url=f"attachment://{filename}")
+        await ctx.send(embed=embed, file=discord.File(filepath, filename=filename))
     else:
         await ctx.send("😢 Мемов пока нет. Загрузите их в веб-консоли!")
 
@@ -1144,24 +4343,82 @@ async def cmd_8ball(ctx, *, question: str = None):
     
     await ctx.send(embed=embed)
 
+# Single process default; main() swaps in the unix socket bus for multiple processes
+attach_event_bus(LocalEventBus(), runs_bot=True)
+
 # --- MAIN ---
 
-async def main():
-    await init_database()
-    
-    # Start web server
-    app = web.Application(client_max_size=10*1024*1024)  # 10MB max upload
+async def start_web_server(reuse_port=False):
+    app = web.Application(client_max_size=10*1024*1024, middlewares=[admin_middleware])  # 10MB max upload
     app.add_routes(routes)
     
     runner = web.AppRunner(app)
     await runner.setup()
     
-    site = web.TCPSite(runner, '0.0.0.0', 5000)
+    site = web.TCPSite(runner, WEB_HOST, WEB_PORT, reuse_port=reuse_port)
     await site.start()
-    print("[WEB] + Web API running on http://localhost:5000")
+    return runner
+
+async def start_web_tier(primary):
+    """Load caches and start serving; every web worker runs this"""
+    if primary:
+        await init_database()
+    else:
+        await init_database_connection()
+    await load_meme_hashes()
+    await load_server_folders()
+    await load_admins()
+    await load_guild_settings()
+    await load_automod_rules()
+    asyncio.create_task(reap_idle_websockets())
+    if primary:
+        asyncio.create_task(backfill_meme_hashes())
+    await start_web_server(reuse_port=WEB_WORKERS > 1)
+
+def run_web_worker(worker_id):
+    """Entry point of a secondary web worker process"""
+    global WORKER_ID
+    WORKER_ID = worker_id
+    try:
+        asyncio.run(web_worker_main())
+    except KeyboardInterrupt:
+        pass
+
+async def web_worker_main():
+    attach_event_bus(UnixSocketBus(EVENT_BUS_PATH), runs_bot=False)
+    await event_bus.start()
+    await start_web_tier(primary=False)
+    await event_bus.publish('guild_state_request', {})
+    print(f"[WEB] + Worker {WORKER_ID} serving on port {WEB_PORT}")
+    await wait_for_parent_exit()
+
+def run_bot_process(shard_ids=None):
+    """Entry point of a Discord bot process in split mode"""
+    if shard_ids is not None:
+        bot.shard_ids = shard_ids
+    try:
+        asyncio.run(bot_process_main())
+    except KeyboardInterrupt:
+        pass
+
+async def bot_process_main():
+    attach_event_bus(UnixSocketBus(EVENT_BUS_PATH), runs_bot=True)
+    await event_bus.start()
+    await init_database_connection()
+    await load_server_folders()
+    await load_admins()
+    await load_guild_settings()
+    await load_automod_rules()
     
-    # Start bot
+    bot_task = asyncio.create_task(run_bot())
+    await wait_for_parent_exit()
+    bot_task.cancel()
+
+async def run_bot():
     if TOKEN:
+        await load_meme_pool()
+        await waiting_users.load()
+        asyncio.create_task(waiting_users.run_sweeper())
         async with bot:
             await bot.start(TOKEN)
     else:
@@ -1170,6 +4427,58 @@ async def main():
         while True:
             await asyncio.sleep(3600)
 
+def bot_process_shards():
+    """Shard ids for each bot process, in contiguous blocks"""
+    if BOT_PROCESSES <= 1:
+        return [None]
+    shard_ids = SHARD_IDS or list(range(SHARD_COUNT))
+    size = math.ceil(len(shard_ids) / BOT_PROCESSES)
+    return [shard_ids[i:i + size] for i in range(0, len(shard_ids), size)]
+
+async def main():
+    global WEB_WORKERS, RUN_MODE, BOT_PROCESSES
+    if BOT_PROCESSES > 1 and SHARD_COUNT is None:
+        print("[WARN] BOT_PROCESSES needs a numeric SHARD_COUNT - running one bot process")
+        BOT_PROCESSES = 1
+    if BOT_PROCESSES > 1:
+        RUN_MODE = 'split'
+    multi_process = WEB_WORKERS > 1 or RUN_MODE == 'split'
+    if multi_process and not (hasattr(socket, 'SO_REUSEPORT') and hasattr(socket, 'AF_UNIX')):
+        print("[WARN] SO_REUSEPORT/unix sockets unavailable - running everything in one process")
+        WEB_WORKERS, RUN_MODE, BOT_PROCESSES, multi_process = 1, 'combined', 1, False
+    
+    # Event bus between processes
+    hub = None
+    if multi_process:
+        hub = UnixSocketHub(EVENT_BUS_PATH)
+        await hub.start()
+        attach_event_bus(UnixSocketBus(EVENT_BUS_PATH), runs_bot=RUN_MODE != 'split')
+    await event_bus.start()
+    
+    # Start web server
+    await start_web_tier(primary=True)
+    print(f"[WEB] + Web API running on http://localhost:{WEB_PORT}")
+    
+    context = multiprocessing.get_context('spawn')
+    for worker_id in range(1, WEB_WORKERS):
+        context.Process(target=run_web_worker, args=(worker_id,), daemon=True).start()
+    
+    # Start bot
+    try:
+        if RUN_MODE == 'split':
+            for shard_ids in bot_process_shards():
+                bot_process = context.Process(target=run_bot_process, args=(shard_ids,), daemon=True)
+                bot_process.start()
+                shards = f" (shards {shard_ids})" if shard_ids else ""
+                print(f"[BOT] + Bot running in process {bot_process.pid}{shards}")
+            while True:
+                await asyncio.sleep(3600)
+        else:
+            await run_bot()
+    finally:
+        # The aiosqlite thread would otherwise keep the process (and its workers) alive
+        await db_conn.close()
+
 if __name__ == "__main__":
     try:
         asyncio.run(main())
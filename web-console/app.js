@@ -1855,7 +1855,8 @@
 
                 if (statusEl) {
                     const isOnline = status.status === 'online';
-                    statusEl.textContent = isOnline ? 'Online' : 'Connecting...';
+                    statusEl.textContent = isOnline ? 'Online'
+                        : status.status === 'degraded' ? 'Degraded' : 'Connecting...';
                 }
 
                 if (uptimeEl) {
@@ -1999,6 +2000,9 @@
         ws: null,
         reconnectAttempts: 0,
         maxReconnectAttempts: 5,
+        stream: null,
+        lastSeq: null,
+        keepaliveTimer: null,
 
         init() {
             this.connect();
@@ -2006,7 +2010,10 @@
 
         connect() {
             const wsProtocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-            const wsUrl = `${wsProtocol}//${window.location.host}/ws`;
+            // Catch up on events missed while disconnected; the server replays them before live ones
+            const resume = this.stream && this.lastSeq !== null
+                ? `?stream=${encodeURIComponent(this.stream)}&seq=${this.lastSeq}` : '';
+            const wsUrl = `${wsProtocol}//${window.location.host}/ws${resume}`;
 
             try {
                 this.ws = new WebSocket(wsUrl);
@@ -2014,11 +2021,23 @@
                 this.ws.onopen = () => {
                     console.log('WebSocket connected');
                     this.reconnectAttempts = 0;
+                    // The server reaps sockets that stay silent too long
+                    clearInterval(this.keepaliveTimer);
+                    this.keepaliveTimer = setInterval(() => {
+                        if (this.ws.readyState === WebSocket.OPEN) {
+                            this.ws.send(JSON.stringify({ action: 'ping' }));
+                        }
+                    }, 60000);
                 };
 
                 this.ws.onmessage = (event) => {
                     try {
-                        const { event: eventType, data } = JSON.parse(event.data);
+                        const { event: eventType, seq, data } = JSON.parse(event.data);
+                        if (seq !== undefined) {
+                            // Already applied (replayed and live copies can overlap)
+                            if (this.lastSeq !== null && seq <= this.lastSeq) return;
+                            this.lastSeq = seq;
+                        }
                         this.handleEvent(eventType, data);
                     } catch (e) {
                         console.error('Failed to parse WebSocket message:', e);
@@ -2027,6 +2046,7 @@
 
                 this.ws.onclose = () => {
                     console.log('WebSocket disconnected');
+                    clearInterval(this.keepaliveTimer);
                     this.scheduleReconnect();
                 };
 
@@ -2050,6 +2070,19 @@
 
         handleEvent(eventType, data) {
             switch (eventType) {
+                case 'hello':
+                    if (this.stream === null) {
+                        this.stream = data.stream;
+                        this.lastSeq = data.seq;
+                    }
+                    break;
+                case 'resync_required':
+                    // A new stream restarts numbering; within one stream lastSeq never goes back
+                    this.lastSeq = data.stream === this.stream ? Math.max(this.lastSeq ?? data.seq, data.seq) : data.seq;
+                    this.stream = data.stream;
+                    MemeFeed.loadMemes();
+                    MemeOfDay.load();
+                    break;
                 case 'new_meme':
                     MemeFeed.addMeme(data.meme, true);
                     break;
@@ -2057,6 +2090,9 @@
                     MemeFeed.updateVotes(data.memeId, data.likeCount, data.dislikeCount);
                     MemeOfDay.updateVotes(data.memeId, data.likeCount, data.dislikeCount);
                     break;
+                case 'vote_batch':
+                    data.votes.forEach(vote => this.handleEvent('vote_update', vote));
+                    break;
                 case 'leader_change':
                     MemeOfDay.setMemeOfDay(data.memeOfDay);
                     showToast('🏆 Новый мем дня!', 'success');